@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+"""Time parsing large pages of query results, in each response format."""
+from __future__ import absolute_import
+
+import json
+
+from common import bench, schema
+
+
+def make_xml_response(n):
+    docs = "".join(
+        '<doc><int name="id">%(i)s</int><str name="title">Document number %(i)s</str>'
+        '<str name="body">%(body)s</str>'
+        '<arr name="tags"><str>tag%(t7)s</str><str>tag%(t11)s</str></arr>'
+        '<bool name="in_stock">%(stock)s</bool><long name="views">%(views)s</long>'
+        '<double name="price">%(price)s</double>'
+        '<date name="published">2011-03-12T15:37:32Z</date>'
+        '<str name="colour_s">red</str><int name="rank_i">%(rank)s</int></doc>'
+        % dict(i=i, body="The quick brown fox jumps over the lazy dog. " * 8,
+               t7=i % 7, t11=i % 11, stock="true" if i % 2 else "false",
+               views=i * 1000, price=i * 0.25, rank=i % 100)
+        for i in range(n))
+    return ('<?xml version="1.0" encoding="UTF-8"?><response>'
+            '<lst name="responseHeader"><int name="status">0</int><int name="QTime">3</int></lst>'
+            '<result name="response" numFound="%s" start="0">%s</result></response>' % (n, docs))
+
+
+def make_json_response(n):
+    docs = [{"id": i,
+             "title": "Document number %s" % i,
+             "body": "The quick brown fox jumps over the lazy dog. " * 8,
+             "tags": ["tag%s" % (i % 7), "tag%s" % (i % 11)],
+             "in_stock": bool(i % 2),
+             "views": i * 1000,
+             "price": i * 0.25,
+             "published": "2011-03-12T15:37:32Z",
+             "colour_s": "red",
+             "rank_i": i % 100}
+            for i in range(n)]
+    return json.dumps({"responseHeader": {"status": 0, "QTime": 3},
+                       "response": {"numFound": n, "start": 0, "docs": docs}})
+
+
+def run():
+    for n in (1000, 10000):
+        xml_response = make_xml_response(n)
+        json_response = make_json_response(n)
+        bench("parse xml, %s docs" % n,
+              lambda: schema.parse_response(xml_response, 'xml'))
+        bench("parse xml (streamed), %s docs" % n,
+              lambda: list(schema.stream_response(xml_response)))
+        bench("parse json, %s docs" % n,
+              lambda: schema.parse_response(json_response, 'json'))
+
+
+if __name__ == '__main__':
+    run()
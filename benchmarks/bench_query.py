@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""Time building queries: constructing and serializing deep boolean
+query trees, and turning a full search's options into parameters."""
+from __future__ import absolute_import
+
+from common import bench, schema
+
+from sunburnt.search import LuceneQuery, SolrSearch, params_from_dict
+
+
+class MockInterface(object):
+    schema = schema
+
+
+def make_tree(depth, i=0):
+    """A boolean query tree of the given depth, mixing AND, OR, NOT,
+    boosts, ranges and phrases, with 2**depth leaves."""
+    q = LuceneQuery(schema)
+    if depth == 0:
+        if i % 3 == 0:
+            return q.Q(title=u"word%s" % i)
+        elif i % 3 == 1:
+            return q.Q(body=u"two words %s" % i, tags=u"tag%s" % i)
+        return q.Q(views__range=(i, i * 10))
+    left = make_tree(depth - 1, 2 * i)
+    right = make_tree(depth - 1, 2 * i + 1)
+    if depth % 3 == 0:
+        return left & ~right
+    elif depth % 3 == 1:
+        return left | right
+    return (left & right) ** 1.5
+
+
+def make_search():
+    return SolrSearch(MockInterface()) \
+        .query(title=u"fox", body=u"quick brown") \
+        .query(make_tree(4)) \
+        .filter(in_stock=True, price__lt=100) \
+        .filter(tags=u"tag3") \
+        .facet_by("tags", limit=20, mincount=1) \
+        .facet_by("colour_s") \
+        .highlight("body", snippets=3) \
+        .sort_by("-published").sort_by("id") \
+        .field_limit(["id", "title", "price"], score=True) \
+        .paginate(start=100, rows=50)
+
+
+def run():
+    for depth in (4, 8):
+        bench("construct tree, depth %s" % depth, lambda: make_tree(depth))
+        bench("construct and serialize tree, depth %s" % depth,
+              lambda: unicode(make_tree(depth)))
+    search = make_search()
+    bench("search options()", search.options)
+    options = search.options()
+    bench("params_from_dict", lambda: params_from_dict(**options))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python
+"""Time matching field names against a schema with many dynamic fields,
+comparing the indexed lookup with a linear scan of the patterns."""
+from __future__ import absolute_import
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+from common import bench
+
+from sunburnt.schema import SolrSchema
+
+
+def make_schema(n_patterns):
+    patterns = []
+    for i in range(n_patterns // 2):
+        patterns.append('<dynamicField name="*_d%s" type="string"/>' % i)
+        patterns.append('<dynamicField name="p%s_*" type="string"/>' % i)
+    patterns.append('<dynamicField name="*_s" type="string"/>')
+    patterns.append('<dynamicField name="*_i" type="int"/>')
+    return SolrSchema(StringIO("""<schema name="benchmark" version="1.1">
+  <types>
+    <fieldType name="string" class="solr.StrField"/>
+    <fieldType name="int" class="solr.IntField"/>
+  </types>
+  <fields>
+    <field name="id" required="true" type="int"/>
+    %s
+  </fields>
+  <uniqueKey>id</uniqueKey>
+</schema>""" % "\n    ".join(patterns)))
+
+
+def linear_match(schema, name):
+    # What match_dynamic_field did before it was indexed: return the
+    # first pattern, in schema order, which matches.
+    for field in schema.dynamic_fields:
+        if field.match(name):
+            return field
+
+
+def run():
+    for n_patterns in (10, 80):
+        schema = make_schema(n_patterns)
+        names = ["title_s", "count_i", "p3_colour", "size_d4", "id"] * 20
+        bench("linear scan, %s patterns" % n_patterns,
+              lambda: [schema.fields.get(n) or linear_match(schema, n) for n in names])
+        # With a memo size of 0, the memo is cleared before every lookup,
+        # and as consecutive names differ it's never hit.
+        schema.dynamic_field_memo_size = 0
+        bench("indexed, %s patterns" % n_patterns,
+              lambda: [schema.match_field(n) for n in names])
+        schema.dynamic_field_memo_size = SolrSchema.dynamic_field_memo_size
+        bench("indexed and memoized, %s patterns" % n_patterns,
+              lambda: [schema.match_field(n) for n in names])
+
+
+if __name__ == '__main__':
+    run()
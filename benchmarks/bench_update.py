@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""Compare generating XML and JSON update messages for the same documents."""
+from __future__ import absolute_import
+
+from common import bench, make_docs, schema
+
+
+def run():
+    for n in (1000, 10000):
+        docs = make_docs(n)
+        xml_rate = bench("xml update, %s docs" % n,
+                         lambda: str(schema.make_update(docs)))
+        bench("xml update (streamed), %s docs" % n,
+              lambda: "".join(schema.make_update(docs, stream=True)))
+        json_rate = bench("json update, %s docs" % n,
+                          lambda: str(schema.make_update(docs, update_format='json')))
+        print "%-50s %12.2fx" % ("json speedup over xml, %s docs" % n,
+                                 json_rate / xml_rate)
+        print "%-50s %12s bytes" % ("xml message size, %s docs" % n,
+                                    len(str(schema.make_update(docs))))
+        print "%-50s %12s bytes" % ("json message size, %s docs" % n,
+                                    len(str(schema.make_update(docs, update_format='json'))))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,100 @@
+"""Shared fixtures for the sunburnt benchmarks.
+
+Everything here runs offline: the schema is parsed from a string, and
+nothing talks to a Solr server.
+"""
+from __future__ import absolute_import
+
+import gc, os, sys, timeit
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sunburnt.schema import SolrSchema
+
+schema_string = \
+"""<schema name="benchmark" version="1.1">
+  <types>
+    <fieldType name="string" class="solr.StrField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="text" class="solr.TextField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="boolean" class="solr.BoolField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="int" class="solr.IntField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="long" class="solr.LongField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="double" class="solr.DoubleField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="date" class="solr.DateField" sortMissingLast="true" omitNorms="true"/>
+  </types>
+  <fields>
+    <field name="id" required="true" type="int"/>
+    <field name="title" required="true" type="text"/>
+    <field name="body" type="text"/>
+    <field name="tags" type="string" multiValued="true"/>
+    <field name="in_stock" type="boolean"/>
+    <field name="views" type="long"/>
+    <field name="price" type="double"/>
+    <field name="published" type="date"/>
+    <dynamicField name="*_s" type="string"/>
+    <dynamicField name="*_i" type="int"/>
+  </fields>
+  <defaultSearchField>title</defaultSearchField>
+  <uniqueKey>id</uniqueKey>
+</schema>"""
+
+schema = SolrSchema(StringIO(schema_string))
+
+
+def make_docs(n):
+    import datetime
+    published = datetime.datetime(2011, 3, 12, 15, 37, 32)
+    return [{"id":i,
+             "title":u"Document number %s" % i,
+             "body":u"The quick brown fox jumps over the lazy dog. " * 8,
+             "tags":[u"tag%s" % (i % 7), u"tag%s" % (i % 11)],
+             "in_stock":bool(i % 2),
+             "views":i * 1000,
+             "price":i * 0.25,
+             "published":published,
+             "colour_s":u"red",
+             "rank_i":i % 100}
+            for i in range(n)]
+
+
+def bench(name, fn, number=None, repeat=3):
+    """Time fn, printing and returning the best rate in ops/sec, along
+    with the objects a call leaves alive (see retained_objects()).
+
+    If number isn't given, it's chosen so that each repeat runs for
+    roughly 0.2 seconds."""
+    timer = timeit.Timer(fn)
+    if number is None:
+        number = 1
+        while timer.timeit(number) < 0.2:
+            number *= 2
+    best = min(timer.repeat(repeat, number)) / number
+    print "%-50s %12.1f ops/sec %10d retained/op" % (name, 1.0 / best, retained_objects(fn))
+    return 1.0 / best
+
+
+def retained_objects(fn):
+    """Count the objects tracked by the garbage collector (dicts, lists,
+    class instances and so on) which are created by one call of fn and
+    still alive when it returns, including its result.
+
+    This is not a count of allocations: Python 2 has no allocation
+    tracer, so it is read from the collector's count of allocations
+    less deallocations, with collection turned off, and temporaries
+    freed before fn returns cancel out. It does track how much a call
+    builds and keeps."""
+    gc.collect()
+    gc.disable()
+    try:
+        before = gc.get_count()[0]
+        result = fn()
+        after = gc.get_count()[0]
+    finally:
+        gc.enable()
+    del result
+    return after - before
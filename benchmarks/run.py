@@ -0,0 +1,26 @@
+#!/usr/bin/env python
+"""Run every benchmark, or those named on the command line
+(for instance: python run.py query parse)."""
+from __future__ import absolute_import
+
+import sys
+
+import bench_parse, bench_query, bench_schema, bench_update
+
+suites = [("query", bench_query),
+          ("update", bench_update),
+          ("parse", bench_parse),
+          ("schema", bench_schema)]
+
+
+def main(names):
+    for name, module in suites:
+        if names and name not in names:
+            continue
+        print "== %s: %s" % (name, module.__doc__.strip().splitlines()[0])
+        module.run()
+        print
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -1,8 +1,13 @@
 from __future__ import absolute_import
 
+from .instrumentation import Instrumentation
 from .strings import RawString
-from .sunburnt import SolrError, SolrInterface
+from .sunburnt import AsyncSolrInterface, ShardedSolrInterface, SolrError, SolrInterface, \
+    SolrUpdateError
+from .transport import CircuitBreaker, CircuitOpenError, DeadlineExceeded, RetryPolicy
 
 __version__ = '0.5'
 
-__all__ = ['RawString', 'SolrError', 'SolrInterface']
+__all__ = ['AsyncSolrInterface', 'CircuitBreaker', 'CircuitOpenError', 'DeadlineExceeded',
+           'Instrumentation', 'RawString', 'RetryPolicy', 'ShardedSolrInterface', 'SolrError', 'SolrInterface',
+           'SolrUpdateError']
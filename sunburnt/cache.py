@@ -0,0 +1,269 @@
+from __future__ import absolute_import
+
+import collections
+import cStringIO as StringIO
+import errno
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+from .schema import SolrSchema
+
+
+class CacheStats(object):
+    """Counters describing how well a QueryCache is doing."""
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        if not lookups:
+            return 0.0
+        return float(self.hits) / lookups
+
+    def __repr__(self):
+        return "<CacheStats hits=%s misses=%s expirations=%s evictions=%s invalidations=%s>" \
+            % (self.hits, self.misses, self.expirations, self.evictions, self.invalidations)
+
+
+class QueryCache(object):
+    """A thread-safe in-process cache of raw Solr response bodies,
+    keyed on the request's (sorted, encoded) parameters.
+
+    Bodies are evicted least recently used first once their total size
+    exceeds max_bytes, and expire ttl seconds after they were fetched
+    (if ttl is given). Bodies rather than parsed responses are cached,
+    since a SolrResponse may be modified by the caller (for instance
+    by execute()'s constructor); parsing is cheap next to a round trip
+    to Solr.
+
+    invalidate() empties the cache, and also bumps its generation, so
+    that responses to requests which were already in flight when it
+    was called aren't stored afterwards.
+    """
+    def __init__(self, max_bytes=10*1024*1024, ttl=None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.generation = 0
+        self.lock = threading.Lock()
+        self.stats = CacheStats()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires, body = entry
+            if expires is not None and expires <= time.time():
+                self.size -= len(body)
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            # Re-insert, to mark it as the most recently used.
+            self.entries[key] = entry
+            self.stats.hits += 1
+            return body
+
+    def set(self, key, body, generation=None):
+        if len(body) > self.max_bytes:
+            return
+        expires = time.time() + self.ttl if self.ttl is not None else None
+        with self.lock:
+            if generation is not None and generation != self.generation:
+                return
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.size -= len(old[1])
+            self.entries[key] = (expires, body)
+            self.size += len(body)
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+                self.stats.evictions += 1
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
+            self.generation += 1
+            self.stats.invalidations += 1
+
+    def fetch(self, key, fn):
+        """Return the cached body for key, or else call fn to fetch it,
+        caching the result."""
+        generation = self.generation
+        body = self.get(key)
+        if body is None:
+            body = fn()
+            self.set(key, body, generation)
+        return body
+
+
+class InFlightCall(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.exc_info = None
+
+
+class SingleFlight(object):
+    """Coalesces identical requests made at the same time: while a
+    request for a key is in flight, other callers asking for the same
+    key wait for it and share its result (or its exception), rather
+    than making the request again.
+
+    calls counts the requests made, and coalesced the callers which
+    shared another's result instead.
+    """
+    def __init__(self):
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+
+    def fetch(self, key, fn):
+        """Return (fn(), shared), where shared is True if the result
+        came from another caller's call of fn for the same key."""
+        with self.lock:
+            call = self.in_flight.get(key)
+            if call is None:
+                call = self.in_flight[key] = InFlightCall()
+                self.calls += 1
+                leader = True
+            else:
+                self.coalesced += 1
+                leader = False
+        if not leader:
+            call.done.wait()
+            if call.exc_info is not None:
+                raise call.exc_info[0], call.exc_info[1], call.exc_info[2]
+            return call.result, True
+        try:
+            call.result = fn()
+        except:
+            call.exc_info = sys.exc_info()
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            call.done.set()
+        return call.result, False
+
+
+class SchemaCache(object):
+    """Keeps the definitions read from remote schemas on local disk, so
+    that a SolrInterface can start up without fetching and parsing its
+    schema.
+
+    Each schema is stored as JSON in its own file in directory, named
+    for a hash of its URL, along with a hash of the schema document and
+    the validators (ETag and Last-Modified) it was served with. Within
+    ttl seconds of being fetched, the stored definitions are used
+    without asking Solr at all. After that (or always, if ttl is None)
+    Solr is asked conditionally, and the stored definitions are used
+    unless the schema has actually changed.
+    """
+    format_version = 1
+
+    def __init__(self, directory, ttl=None):
+        self.directory = directory
+        self.ttl = ttl
+
+    def path(self, url):
+        return os.path.join(self.directory,
+                            "%s.json" % hashlib.sha1(url).hexdigest())
+
+    def load(self, url):
+        try:
+            with open(self.path(url)) as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+        if entry.get("version") != self.format_version or entry.get("url") != url:
+            return None
+        entry["definitions"] = ascii_strings(entry["definitions"])
+        return entry
+
+    def store(self, url, entry):
+        try:
+            os.makedirs(self.directory)
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+        # Write to a temporary file and rename it into place, so that
+        # concurrent readers never see a partly written file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(entry, f)
+            os.rename(tmp_path, self.path(url))
+        except:
+            os.unlink(tmp_path)
+            raise
+
+    def fetch(self, url, request, revalidate=False):
+        """Return a SolrSchema for the schema at url, using request (with
+        the signature of httplib2.Http.request) when it must be fetched.
+        If revalidate is True, Solr is asked even within the ttl."""
+        entry = self.load(url)
+        if entry is not None and self.ttl is not None and not revalidate \
+                and time.time() - entry["fetched"] < self.ttl:
+            return SolrSchema.from_definitions(entry["definitions"])
+
+        headers = {}
+        if entry is not None:
+            if entry.get("etag"):
+                headers["If-None-Match"] = entry["etag"]
+            if entry.get("last_modified"):
+                headers["If-Modified-Since"] = entry["last_modified"]
+        r, c = request(url, headers=headers)
+        if r.status == 304 and entry is not None:
+            definitions = entry["definitions"]
+        elif r.status == 200:
+            content_hash = hashlib.sha1(c).hexdigest()
+            if entry is not None and entry["content_hash"] == content_hash:
+                definitions = entry["definitions"]
+            else:
+                definitions = SolrSchema.schema_definitions(StringIO.StringIO(c))
+            entry = {"version": self.format_version,
+                     "url": url,
+                     "content_hash": content_hash,
+                     "etag": r.get("etag"),
+                     "last_modified": r.get("last-modified"),
+                     "definitions": definitions}
+        else:
+            raise EnvironmentError("Couldn't retrieve schema document from server - received status code %s\n%s" % (r.status, c))
+        entry["fetched"] = time.time()
+        self.store(url, entry)
+        return SolrSchema.from_definitions(definitions)
+
+
+def ascii_strings(v):
+    """json returns unicode strings throughout, where lxml returns
+    plain strings for ASCII text; convert them back so that stored
+    definitions are just as they were when first read."""
+    if isinstance(v, unicode):
+        try:
+            return v.encode("ascii")
+        except UnicodeError:
+            return v
+    elif isinstance(v, dict):
+        return dict((ascii_strings(k), ascii_strings(x)) for k, x in v.items())
+    elif isinstance(v, list):
+        return [ascii_strings(x) for x in v]
+    return v
@@ -0,0 +1,326 @@
+from __future__ import absolute_import
+
+import collections
+import Queue
+import random
+import socket
+import sys
+import threading
+import time
+
+from .schema import SolrError
+from .transport import CircuitOpenError, DeadlineExceeded
+
+
+class ReplicaState(object):
+    """What a LoadBalancedConnection knows about one replica: how many
+    requests it has in flight, a moving average of its response time,
+    and whether it's currently in rotation."""
+    # Weight given to each new response time in the moving average.
+    latency_decay = 0.2
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.outstanding = 0
+        self.latency = None
+        self.healthy = True
+        self.down_until = 0
+
+    @property
+    def available(self):
+        return self.healthy and self.down_until <= time.time()
+
+    def record_latency(self, latency):
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency += self.latency_decay * (latency - self.latency)
+
+    def __repr__(self):
+        return "<ReplicaState %s outstanding=%s latency=%s healthy=%s>" \
+            % (self.conn.url, self.outstanding, self.latency, self.available)
+
+
+class AttemptThreads(object):
+    """Daemon threads for running hedged query attempts, each kept for
+    reuse once its attempt is done, so that hedging doesn't start a new
+    thread for every query. A thread is only started when every
+    existing one is busy."""
+    def __init__(self, name):
+        self.name = name
+        self.tasks = Queue.Queue()
+        self.idle = 0
+        self.lock = threading.Lock()
+
+    def run(self, fn):
+        with self.lock:
+            start = not self.idle
+            if not start:
+                self.idle -= 1
+        if start:
+            thread = threading.Thread(target=self.work, name=self.name)
+            thread.daemon = True
+            thread.start()
+        self.tasks.put(fn)
+
+    def work(self):
+        while True:
+            fn = self.tasks.get()
+            try:
+                fn()
+            except Exception:
+                pass
+            with self.lock:
+                self.idle += 1
+
+
+class LoadBalancedConnection(object):
+    """Spreads queries across several replicas of the same Solr core,
+    with the same interface as a single SolrConnection.
+
+    Queries go to the replica chosen by policy, from those in rotation:
+    'least_outstanding' picks the replica with the fewest requests in
+    flight, and 'latency' picks at random, weighted towards replicas
+    which have been responding quickly. If a query fails with a socket
+    error or a 5xx response, that replica is taken out of rotation for
+    down_time seconds, and the query is tried on another. Updates, and
+    fetching the schema, always go to the first replica.
+
+    If health_check_interval is given, a background thread pings every
+    replica (at admin/ping) that often, taking replicas out of rotation
+    while the ping fails and putting them back once it succeeds. Each
+    replica's connection must then be a pool (see ensure_pool()).
+
+    If hedge_percentile is given (say 95), queries are hedged: if the
+    first replica hasn't answered within that percentile of recent
+    response times, the query is also sent to another replica, and
+    whichever answers first is used. The slower request can't be
+    aborted, but its response is ignored. No more than hedge_budget
+    extra requests are sent per query (on average), so that hedging
+    can't snowball when every replica is slow. As the slower request
+    carries on in another thread, each replica's connection must be a
+    pool of at least hedge_burst + 1 (see ensure_pool()).
+    """
+    policies = ('least_outstanding', 'latency')
+    ping_path = "admin/ping"
+    # Response times remembered for the hedging percentile, and how many
+    # are needed before queries are hedged at all.
+    latency_samples = 1000
+    hedge_min_samples = 20
+    # The most unused hedges which can be saved up for a burst.
+    hedge_burst = 10
+
+    def __init__(self, connections, policy='least_outstanding', down_time=30.0,
+                 health_check_interval=None, hedge_percentile=None, hedge_budget=0.05):
+        if not connections:
+            raise ValueError("At least one replica is needed")
+        if policy not in self.policies:
+            raise ValueError("policy must be one of %s" % list(self.policies))
+        self.replicas = [ReplicaState(conn) for conn in connections]
+        self.primary = connections[0]
+        self.url = self.primary.url
+        self.policy = policy
+        self.down_time = down_time
+        self.lock = threading.Lock()
+        if hedge_percentile is not None and not 0 < hedge_percentile < 100:
+            raise ValueError("hedge_percentile must be between 0 and 100")
+        self.hedge_percentile = hedge_percentile
+        self.hedge_budget = hedge_budget
+        self.hedge_tokens = 0.0
+        self.latencies = collections.deque(maxlen=self.latency_samples)
+        self.hedges = 0
+        self.attempt_threads = AttemptThreads("sunburnt-hedged-query")
+        if hedge_percentile is not None:
+            # A losing attempt carries on in the background, alongside
+            # later queries to the same replica; the budget allows
+            # about hedge_burst of those at once.
+            self.ensure_pool(self.hedge_burst + 1)
+        self.health_check_interval = health_check_interval
+        self.stopped = threading.Event()
+        self.health_thread = None
+        if health_check_interval:
+            # The pings run alongside queries, so mustn't share a
+            # single httplib2.Http with them.
+            self.ensure_pool(2)
+            self.health_thread = threading.Thread(target=self.health_check_loop,
+                                                  name="sunburnt-health-check")
+            self.health_thread.daemon = True
+            self.health_thread.start()
+
+    # Updates and other requests go to the primary.
+    def request(self, *args, **kwargs):
+        return self.primary.request(*args, **kwargs)
+
+    def update(self, *args, **kwargs):
+        return self.primary.update(*args, **kwargs)
+
+    def commit(self, *args, **kwargs):
+        return self.primary.commit(*args, **kwargs)
+
+    def optimize(self, *args, **kwargs):
+        return self.primary.optimize(*args, **kwargs)
+
+    def rollback(self):
+        return self.primary.rollback()
+
+    def ensure_pool(self, size):
+        for replica in self.replicas:
+            replica.conn.ensure_pool(size)
+
+    # Queries are balanced.
+    def select(self, params, deadline=None, trace=None):
+        return self.balanced(lambda conn: conn.select(params, deadline=deadline, trace=trace))
+
+    def mlt(self, params, content=None, deadline=None, trace=None):
+        return self.balanced(lambda conn: conn.mlt(params, content=content, deadline=deadline, trace=trace))
+
+    def choose(self, exclude=()):
+        with self.lock:
+            candidates = [r for r in self.replicas if r not in exclude]
+            if not candidates:
+                return None
+            # If no replica is in rotation, try them anyway rather
+            # than fail without trying.
+            candidates = [r for r in candidates if r.available] or candidates
+            if self.policy == 'least_outstanding':
+                fewest = min(r.outstanding for r in candidates)
+                replica = random.choice([r for r in candidates if r.outstanding == fewest])
+            else:
+                replica = self.weighted_choice(candidates)
+            replica.outstanding += 1
+            return replica
+
+    @staticmethod
+    def weighted_choice(candidates):
+        # Replicas with no measurements yet are weighted as the fastest,
+        # so that they get measured.
+        latencies = [r.latency for r in candidates if r.latency is not None]
+        fastest = min(latencies) if latencies else 1.0
+        weights = [1.0 / max(r.latency if r.latency is not None else fastest, 1e-6)
+                   for r in candidates]
+        x = random.uniform(0, sum(weights))
+        for replica, weight in zip(candidates, weights):
+            x -= weight
+            if x <= 0:
+                return replica
+        return candidates[-1]
+
+    def balanced(self, fn):
+        delay = self.hedge_delay()
+        if delay is None or self.hedge_tokens < 1:
+            # There will be no hedge, so nothing to wait for but this.
+            return self.attempt(fn, [])
+        # Each attempt runs in another thread, so that this one can
+        # wait for whichever answers first. Both share the list of
+        # replicas tried, so that the hedge goes to a different replica.
+        tried = []
+        results = Queue.Queue()
+        def run():
+            try:
+                results.put((True, self.attempt(fn, tried)))
+            except Exception:
+                results.put((False, sys.exc_info()))
+        self.attempt_threads.run(run)
+        attempts = 1
+        try:
+            success, result = results.get(timeout=delay)
+        except Queue.Empty:
+            if self.take_hedge_token():
+                self.attempt_threads.run(run)
+                attempts += 1
+            success, result = results.get()
+        while not success:
+            attempts -= 1
+            if not attempts:
+                raise result[0], result[1], result[2]
+            success, result = results.get()
+        return result
+
+    def hedge_delay(self):
+        """How long to wait for a query before hedging it, or None if it
+        shouldn't be hedged."""
+        if self.hedge_percentile is None or len(self.replicas) < 2:
+            return None
+        with self.lock:
+            self.hedge_tokens = min(self.hedge_tokens + self.hedge_budget, self.hedge_burst)
+            if len(self.latencies) < self.hedge_min_samples:
+                return None
+            latencies = sorted(self.latencies)
+        return latencies[int(len(latencies) * self.hedge_percentile / 100.0)]
+
+    def take_hedge_token(self):
+        with self.lock:
+            if self.hedge_tokens < 1:
+                return False
+            self.hedge_tokens -= 1
+            self.hedges += 1
+            return True
+
+    def attempt(self, fn, tried):
+        last_error = None
+        while True:
+            replica = self.choose(exclude=tried)
+            if replica is None:
+                if last_error is None:
+                    # A hedged query, with every replica already tried.
+                    raise SolrError("No replica left to try")
+                raise last_error[0], last_error[1], last_error[2]
+            tried.append(replica)
+            t0 = time.time()
+            try:
+                result = fn(replica.conn)
+            except (socket.error, SolrError), e:
+                if not self.is_replica_failure(e):
+                    raise
+                last_error = sys.exc_info()
+                self.take_out_of_rotation(replica)
+                continue
+            else:
+                latency = time.time() - t0
+                with self.lock:
+                    replica.record_latency(latency)
+                    self.latencies.append(latency)
+                return result
+            finally:
+                with self.lock:
+                    replica.outstanding -= 1
+
+    @staticmethod
+    def is_replica_failure(e):
+        """Whether e means the replica is unwell (rather than, say, that
+        the query was malformed, which would fail on any replica, or
+        that its deadline has passed, which leaves no time to try
+        another)."""
+        if isinstance(e, DeadlineExceeded):
+            return False
+        if isinstance(e, (socket.error, CircuitOpenError)):
+            return True
+        response = e.args[0] if e.args else None
+        return getattr(response, "status", 0) >= 500
+
+    def take_out_of_rotation(self, replica):
+        with self.lock:
+            replica.down_until = time.time() + self.down_time
+
+    def check_health(self):
+        """Ping each replica once, updating whether it's in rotation."""
+        for replica in self.replicas:
+            try:
+                r, c = replica.conn.request(replica.conn.url + self.ping_path)
+                healthy = r.status == 200
+            except Exception:
+                healthy = False
+            with self.lock:
+                replica.healthy = healthy
+                if healthy:
+                    replica.down_until = 0
+
+    def health_check_loop(self):
+        while not self.stopped.wait(self.health_check_interval):
+            self.check_health()
+
+    def close(self):
+        """Stop the health check thread, if there is one."""
+        self.stopped.set()
+        if self.health_thread is not None:
+            self.health_thread.join()
@@ -90,3 +90,15 @@ if mx:
 else:
     def datetime_delta_factory(hours, minutes):
         return datetime.timedelta(hours=hours, minutes=minutes)
+
+if mx:
+    def datetime_from_millis(ms):
+        """Convert milliseconds since the epoch (as used by javabin) into
+        the same kind of object as datetime_from_w3_datestring."""
+        return mx.DateTime.DateTime(1970) + mx.DateTime.DateTimeDeltaFromSeconds(ms / 1000.0)
+else:
+    epoch = datetime.datetime(1970, 1, 1)
+    def datetime_from_millis(ms):
+        """Convert milliseconds since the epoch (as used by javabin) into
+        the same kind of object as datetime_from_w3_datestring."""
+        return epoch + datetime.timedelta(milliseconds=ms)
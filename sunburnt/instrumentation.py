@@ -0,0 +1,131 @@
+from __future__ import absolute_import
+
+import collections
+import contextlib
+import logging
+import time
+
+log = logging.getLogger(__name__)
+
+
+class RequestTrace(object):
+    """What was measured about one query, as it passes through each
+    phase: building its parameters, URL encoding, the HTTP round trip,
+    parsing the response and transforming the results.
+
+    timings maps each phase which has run so far to the seconds spent
+    in it. posted is True if the query was too long for a GET and was
+    POSTed instead; cached is True if it was answered from the
+    in-process cache, without contacting Solr at all, and coalesced if
+    it shared the response to an identical query already in flight
+    (in which case no HTTP phase is recorded). request_bytes
+    counts the URL and body sent, and response_bytes the (decompressed)
+    body received. qtime is Solr's own QTime, in milliseconds. error is
+    the exception the query raised, if it failed.
+    """
+    def __init__(self, instrumentation, kind):
+        self.instrumentation = instrumentation
+        self.kind = kind
+        self.started = time.time()
+        self.timings = collections.OrderedDict()
+        self.method = None
+        self.url = None
+        self.posted = False
+        self.cached = False
+        self.coalesced = False
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status = None
+        self.qtime = None
+        self.duration = None
+        self.error = None
+
+    @property
+    def overhead(self):
+        """Seconds of the HTTP round trip not accounted for by Solr's
+        QTime: the network, queueing in the servlet container, and
+        writing the response."""
+        if self.qtime is None or 'http' not in self.timings:
+            return None
+        return self.timings['http'] - self.qtime / 1000.0
+
+    def __repr__(self):
+        return "<RequestTrace %s %s %s timings=%s qtime=%s error=%r>" \
+            % (self.kind, self.method, self.url, dict(self.timings), self.qtime, self.error)
+
+
+class RequestEvent(object):
+    """Passed to listeners as each phase of a query finishes. The final
+    event of every query, whether it succeeded or not, has phase
+    'complete', and its duration is the wall time of the whole query."""
+    def __init__(self, phase, duration, trace):
+        self.phase = phase
+        self.duration = duration
+        self.trace = trace
+
+    def __repr__(self):
+        return "<RequestEvent %s %.6f>" % (self.phase, self.duration)
+
+
+class Instrumentation(object):
+    """Calls each listener with a RequestEvent as each phase of each
+    query finishes. Errors raised by listeners are logged, not
+    propagated to the query."""
+    def __init__(self, listeners=()):
+        self.listeners = list(listeners)
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+
+    def remove_listener(self, listener):
+        self.listeners.remove(listener)
+
+    def trace(self, kind):
+        return RequestTrace(self, kind)
+
+    def fire(self, phase, duration, trace):
+        event = RequestEvent(phase, duration, trace)
+        for listener in self.listeners:
+            try:
+                listener(event)
+            except Exception:
+                log.exception("Instrumentation listener %r failed", listener)
+
+
+@contextlib.contextmanager
+def phase(trace, name):
+    """Time the block as phase name of trace (if there is one).
+    A phase which runs more than once in a query accumulates."""
+    if trace is None:
+        yield
+        return
+    t0 = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - t0
+        trace.timings[name] = trace.timings.get(name, 0.0) + duration
+        trace.instrumentation.fire(name, duration, trace)
+
+
+def complete(trace):
+    """Fire the 'complete' event for trace (if there is one)."""
+    if trace is None:
+        return
+    trace.duration = time.time() - trace.started
+    trace.instrumentation.fire('complete', trace.duration, trace)
+
+
+@contextlib.contextmanager
+def completion(trace):
+    """Fire the 'complete' event for trace (if there is one) once the
+    block has finished, recording any exception it raised as
+    trace.error."""
+    try:
+        yield
+    except Exception, e:
+        if trace is not None:
+            trace.error = e
+        raise
+    finally:
+        complete(trace)
@@ -0,0 +1,231 @@
+"""A pure-Python decoder for Solr's javabin response format (wt=javabin).
+
+Values are decoded straight into Python objects, in the same shapes as
+schema.value_from_node produces for XML responses: named lists become
+lists of (name, value) pairs, arrays become lists, and documents become
+dictionaries. Document lists become dictionaries with numFound, start,
+maxScore and docs keys.
+"""
+from __future__ import absolute_import
+
+import struct
+
+from .dates import datetime_from_millis
+
+
+# Tags with no size or value packed into them.
+NULL = 0
+BOOL_TRUE = 1
+BOOL_FALSE = 2
+BYTE = 3
+SHORT = 4
+DOUBLE = 5
+INT = 6
+LONG = 7
+FLOAT = 8
+DATE = 9
+MAP = 10
+SOLRDOC = 11
+SOLRDOCLST = 12
+BYTEARR = 13
+ITERATOR = 14
+END = 15
+SOLRINPUTDOC = 16
+SOLRINPUTDOC_CHILDS = 17
+ENUM_FIELD_VALUE = 18
+MAP_ENTRY = 19
+
+# Tags identified by their top three bits, with a size or value
+# packed into the remaining five.
+STR = 1 << 5
+SINT = 2 << 5
+SLONG = 3 << 5
+ARR = 4 << 5
+ORDERED_MAP = 5 << 5
+NAMED_LST = 6 << 5
+EXTERN_STRING = 7 << 5
+
+VERSION = 2
+
+_byte = struct.Struct(">b")
+_short = struct.Struct(">h")
+_int = struct.Struct(">i")
+_long = struct.Struct(">q")
+_float = struct.Struct(">f")
+_double = struct.Struct(">d")
+
+
+class JavabinError(ValueError):
+    pass
+
+
+class _End(object):
+    """Marks the end of an ITERATOR."""
+
+END_OBJ = _End()
+
+
+class JavabinDecoder(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+        self.strings = []
+
+    def decode(self):
+        version = ord(self.data[0])
+        if version > VERSION:
+            raise JavabinError("Unsupported javabin version %s" % version)
+        self.pos = 1
+        return self.read_val()
+
+    def read_byte(self):
+        b = ord(self.data[self.pos])
+        self.pos += 1
+        return b
+
+    def read_struct(self, s):
+        v = s.unpack_from(self.data, self.pos)[0]
+        self.pos += s.size
+        return v
+
+    def read_vint(self):
+        b = self.read_byte()
+        i = b & 0x7f
+        shift = 7
+        while b & 0x80:
+            b = self.read_byte()
+            i |= (b & 0x7f) << shift
+            shift += 7
+        return i
+
+    def read_size(self, tag):
+        size = tag & 0x1f
+        if size == 0x1f:
+            size += self.read_vint()
+        return size
+
+    def read_val(self):
+        tag = self.read_byte()
+        handler = self.tag_handlers.get(tag >> 5)
+        if handler is not None:
+            return handler(self, tag)
+        try:
+            handler = self.simple_handlers[tag]
+        except KeyError:
+            raise JavabinError("Unknown javabin tag %s at offset %s" % (tag, self.pos - 1))
+        return handler(self)
+
+    def read_bytes(self, size):
+        if self.pos + size > len(self.data):
+            raise IndexError(self.pos + size)
+        data = self.data[self.pos:self.pos+size]
+        self.pos += size
+        return data
+
+    def read_str(self, tag):
+        return self.read_bytes(self.read_size(tag)).decode('utf-8')
+
+    def read_small_int(self, tag):
+        v = tag & 0x0f
+        if tag & 0x10:
+            v |= self.read_vint() << 4
+        return v
+
+    def read_array(self, tag):
+        return [self.read_val() for i in xrange(self.read_size(tag))]
+
+    def read_named_list(self, tag):
+        read_val = self.read_val
+        return [(read_val(), read_val()) for i in xrange(self.read_size(tag))]
+
+    def read_extern_string(self, tag):
+        index = self.read_size(tag)
+        if index:
+            return self.strings[index - 1]
+        s = self.read_val()
+        self.strings.append(s)
+        return s
+
+    def read_float(self):
+        raw = self.data[self.pos:self.pos+4]
+        v = self.read_struct(_float)
+        # Widening to a double shows up the float's binary representation
+        # (0.1 becomes 0.10000000149011612); instead use the shortest
+        # decimal which maps to the same float, as Solr does in XML.
+        for precision in (6, 7, 8):
+            shortest = float("%.*g" % (precision, v))
+            if _float.pack(shortest) == raw:
+                return shortest
+        return v
+
+    def read_map(self):
+        read_val = self.read_val
+        return dict((read_val(), read_val()) for i in xrange(self.read_vint()))
+
+    def read_document(self):
+        fields = self.read_val()
+        return dict(fields)
+
+    def read_document_list(self):
+        num_found, start, max_score = self.read_val()
+        docs = self.read_val()
+        return {"numFound":num_found, "start":start, "maxScore":max_score, "docs":docs}
+
+    def read_byte_array(self):
+        data = self.read_bytes(self.read_vint())
+        # Binary field values are base64-encoded in the XML response
+        # format, and BinaryField.from_solr expects them so.
+        return data.encode('base64')
+
+    def read_iterator(self):
+        values = []
+        while True:
+            v = self.read_val()
+            if v is END_OBJ:
+                return values
+            values.append(v)
+
+    def read_enum(self):
+        self.read_val()  # the enum's ordinal
+        return self.read_val()
+
+    def read_map_entry(self):
+        return (self.read_val(), self.read_val())
+
+    tag_handlers = {
+        STR >> 5: read_str,
+        SINT >> 5: read_small_int,
+        SLONG >> 5: read_small_int,
+        ARR >> 5: read_array,
+        ORDERED_MAP >> 5: read_named_list,
+        NAMED_LST >> 5: read_named_list,
+        EXTERN_STRING >> 5: read_extern_string,
+    }
+
+    simple_handlers = {
+        NULL: lambda self: None,
+        BOOL_TRUE: lambda self: True,
+        BOOL_FALSE: lambda self: False,
+        BYTE: lambda self: self.read_struct(_byte),
+        SHORT: lambda self: self.read_struct(_short),
+        INT: lambda self: self.read_struct(_int),
+        LONG: lambda self: self.read_struct(_long),
+        FLOAT: read_float,
+        DOUBLE: lambda self: self.read_struct(_double),
+        DATE: lambda self: datetime_from_millis(self.read_struct(_long)),
+        MAP: read_map,
+        SOLRDOC: read_document,
+        SOLRDOCLST: read_document_list,
+        BYTEARR: read_byte_array,
+        ITERATOR: read_iterator,
+        END: lambda self: END_OBJ,
+        ENUM_FIELD_VALUE: read_enum,
+        MAP_ENTRY: read_map_entry,
+    }
+
+
+def loads(data):
+    try:
+        return JavabinDecoder(data).decode()
+    except (IndexError, struct.error):
+        raise JavabinError("Truncated javabin message")
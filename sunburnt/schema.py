@@ -1,6 +1,9 @@
 from __future__ import absolute_import
 
+import cStringIO as StringIO
+import csv
 import datetime
+import json
 import math
 import operator
 import uuid
@@ -9,6 +12,7 @@ import warnings
 from lxml.builder import E
 import lxml.etree
 
+from . import javabin
 from .dates import datetime_from_w3_datestring
 from .strings import RawString, SolrString, WildcardString
 
@@ -374,12 +378,26 @@ class SolrSchema(object):
     def __init__(self, f):
         """initialize a schema object from a
         filename or file-like object."""
+        self.init_from_definitions(self.schema_definitions(f))
+
+    @classmethod
+    def from_definitions(cls, definitions):
+        """initialize a schema object from the definitions
+        previously read from a schema by schema_definitions()."""
+        self = cls.__new__(cls)
+        self.init_from_definitions(definitions)
+        return self
+
+    def init_from_definitions(self, definitions):
+        self.definitions = definitions
         self.fields, self.dynamic_fields, self.default_field_name, self.unique_key \
-            = self.schema_parse(f)
+            = self.schema_build(definitions)
         self.default_field = self.fields[self.default_field_name] \
             if self.default_field_name else None
         self.unique_field = self.fields[self.unique_key] \
             if self.unique_key else None
+        self.dynamic_field_index = self.index_dynamic_fields(self.dynamic_fields)
+        self.dynamic_field_memo = {}
 
     def Q(self, *args, **kwargs):
         from .search import LuceneQuery
@@ -388,36 +406,56 @@ class SolrSchema(object):
         return q
 
     def schema_parse(self, f):
+        return self.schema_build(self.schema_definitions(f))
+
+    @staticmethod
+    def schema_definitions(f):
+        """Read the parts of a schema document which sunburnt uses
+        into plain data (dicts, lists and strings), which can be
+        serialized, for instance as JSON."""
         try:
             schemadoc = lxml.etree.parse(f)
         except lxml.etree.XMLSyntaxError, e:
             raise SolrError("Invalid XML in schema:\n%s" % e.args[0])
 
+        default_field_name = schemadoc.xpath("/schema/defaultSearchField")
+        default_field_name = default_field_name[0].text \
+            if default_field_name else None
+        unique_key = schemadoc.xpath("/schema/uniqueKey")
+        unique_key = unique_key[0].text if unique_key else None
+        return {
+            "field_types": [dict(node.attrib) for node in
+                schemadoc.xpath("/schema/types/fieldType|/schema/types/fieldtype")],
+            "fields": [dict(node.attrib) for node in
+                schemadoc.xpath("/schema/fields/field")],
+            "dynamic_fields": [dict(node.attrib) for node in
+                schemadoc.xpath("/schema/fields/dynamicField")],
+            "default_field": default_field_name,
+            "unique_key": unique_key,
+        }
+
+    def schema_build(self, definitions):
         field_type_classes = {}
-        for field_type_node in schemadoc.xpath("/schema/types/fieldType|/schema/types/fieldtype"):
-            name, field_type_class = self.field_type_factory(field_type_node)
+        for attribs in definitions["field_types"]:
+            name, field_type_class = self.field_type_factory(attribs)
             field_type_classes[name] = field_type_class
 
         field_classes = {}
-        for field_node in schemadoc.xpath("/schema/fields/field"):
-            name, field_class = self.field_factory(field_node, field_type_classes, dynamic=False)
+        for attribs in definitions["fields"]:
+            name, field_class = self.field_factory(attribs, field_type_classes, dynamic=False)
             field_classes[name] = field_class
 
         dynamic_field_classes = []
-        for field_node in schemadoc.xpath("/schema/fields/dynamicField"):
-            _, field_class = self.field_factory(field_node, field_type_classes, dynamic=True)
+        for attribs in definitions["dynamic_fields"]:
+            _, field_class = self.field_factory(attribs, field_type_classes, dynamic=True)
             dynamic_field_classes.append(field_class)
 
-        default_field_name = schemadoc.xpath("/schema/defaultSearchField")
-        default_field_name = default_field_name[0].text \
-            if default_field_name else None
-        unique_key = schemadoc.xpath("/schema/uniqueKey")
-        unique_key = unique_key[0].text if unique_key else None
-        return field_classes, dynamic_field_classes, default_field_name, unique_key
+        return field_classes, dynamic_field_classes, \
+            definitions["default_field"], definitions["unique_key"]
 
-    def field_type_factory(self, field_type_node):
+    def field_type_factory(self, attribs):
         try:
-            name, class_name = field_type_node.attrib['name'], field_type_node.attrib['class']
+            name, class_name = attribs['name'], attribs['class']
         except KeyError, e:
             raise SolrError("Invalid schema.xml: missing %s attribute on fieldType" % e.args[0])
         try:
@@ -425,11 +463,11 @@ class SolrSchema(object):
         except KeyError:
             raise SolrError("Unknown field_class '%s'" % class_name)
         return name, SolrFieldTypeFactory(field_class,
-            **self.translate_attributes(field_type_node.attrib))
+            **self.translate_attributes(attribs))
 
-    def field_factory(self, field_node, field_type_classes, dynamic):
+    def field_factory(self, attribs, field_type_classes, dynamic):
         try:
-            name, field_type = field_node.attrib['name'], field_node.attrib['type']
+            name, field_type = attribs['name'], attribs['type']
         except KeyError, e:
             raise SolrError("Invalid schema.xml: missing %s attribute on field" % e.args[0])
         try:
@@ -437,7 +475,7 @@ class SolrSchema(object):
         except KeyError, e:
             raise SolrError("Invalid schema.xml: %s field_type undefined" % field_type)
         return name, field_type_class(dynamic=dynamic,
-            **self.translate_attributes(field_node.attrib))
+            **self.translate_attributes(attribs))
 
     # From XML Datatypes
     attrib_translator = {"true": True, "1": True, "false": False, "0": False}
@@ -466,10 +504,46 @@ class SolrSchema(object):
         if undefined_field_names:
             raise SolrError("Fields not defined in schema: %s" % list(undefined_field_names))
 
+    @staticmethod
+    def index_dynamic_fields(dynamic_fields):
+        """Group dynamic field patterns by length, longest first, so
+        that each length needs only one dictionary lookup for its
+        prefix patterns and one for its suffix patterns.
+
+        As in Solr, the longest matching pattern wins, and of patterns
+        of the same length, the first in the schema."""
+        by_length = {}
+        for order, field in enumerate(dynamic_fields):
+            fixed = field.name[1:] if field.wildcard_at_start else field.name[:-1]
+            suffixes, prefixes = by_length.setdefault(len(fixed), ({}, {}))
+            patterns = suffixes if field.wildcard_at_start else prefixes
+            patterns.setdefault(fixed, (order, field))
+        return sorted(((n, suffixes, prefixes)
+                       for n, (suffixes, prefixes) in by_length.items()),
+                      reverse=True)
+
+    # Enough for every field name in use in most indexes, while bounding
+    # the memory used if names are (for instance) taken from user input.
+    dynamic_field_memo_size = 10000
+
     def match_dynamic_field(self, name):
-        for field in self.dynamic_fields:
-            if field.match(name):
-                return field
+        try:
+            return self.dynamic_field_memo[name]
+        except KeyError:
+            pass
+        field = None
+        for n, suffixes, prefixes in self.dynamic_field_index:
+            if n > len(name):
+                continue
+            suffix = suffixes.get(name[len(name)-n:]) if suffixes else None
+            prefix = prefixes.get(name[:n]) if prefixes else None
+            if suffix or prefix:
+                field = min(m for m in (suffix, prefix) if m)[1]
+                break
+        if len(self.dynamic_field_memo) >= self.dynamic_field_memo_size:
+            self.dynamic_field_memo.clear()
+        self.dynamic_field_memo[name] = field
+        return field
 
     def match_field(self, name):
         try:
@@ -484,15 +558,56 @@ class SolrSchema(object):
             raise SolrError("No such field '%s' in current schema" % k)
         return field.instance_from_user_data(v)
 
-    def make_update(self, docs):
+    def make_update(self, docs, stream=False, update_format='xml'):
+        if update_format == 'json':
+            return SolrJSONUpdate(self, docs)
+        elif stream:
+            return SolrUpdateStream(self, docs)
         return SolrUpdate(self, docs)
 
-    def make_delete(self, docs, query):
+    def make_csv_update(self, rows, field_names):
+        return SolrCSVUpdate(self, rows, field_names)
+
+    def doc_id_from_doc(self, doc):
+        # Is this a dictionary, or an document object, or a thing
+        # that can be cast to a uniqueKey? (which could also be an
+        # arbitrary object.
+        if isinstance(doc, (basestring, int, long, float)):
+            # It's obviously not a document object, just coerce to appropriate type
+            doc_id = doc
+        elif hasattr(doc, "items"):
+            # It's obviously a dictionary
+            try:
+                doc_id = doc[self.unique_key]
+            except KeyError:
+                raise SolrError("No unique key on this document")
+        else:
+            doc_id = get_attribute_or_callable(doc, self.unique_key)
+            if doc_id is None:
+                # Well, we couldn't get an ID from it; let's try
+                # coercing the doc to the type of an ID field.
+                doc_id = doc
+        try:
+            doc_id_inst = self.unique_field.instance_from_user_data(doc_id)
+        except SolrError:
+            raise SolrError("Could not parse argument as object or document id")
+        return doc_id_inst
+
+    def make_delete(self, docs, query, update_format='xml'):
+        if update_format == 'json':
+            return SolrJSONDelete(self, docs, query)
         return SolrDelete(self, docs, query)
 
-    def parse_response(self, msg):
+    def parse_response(self, msg, wt='xml'):
+        if wt == 'javabin':
+            return DecodedSolrResponse(self, javabin.loads(msg))
+        elif wt == 'json':
+            return DecodedSolrResponse(self, json.loads(msg, object_pairs_hook=json_named_list))
         return SolrResponse(self, msg)
 
+    def stream_response(self, msg, constructor=dict):
+        return StreamingSolrResponse(self, msg, constructor)
+
     def parse_result_doc(self, doc, name=None):
         if name is None:
             name = doc.attrib.get('name')
@@ -501,12 +616,30 @@ class SolrSchema(object):
             return name, tuple(v[1] for v in values)
         if doc.tag in 'doc':
             return dict([self.parse_result_doc(n) for n in doc.getchildren()])
+        field_class = self.result_field(name)
+        return name, SolrFieldInstance.from_solr(field_class, doc.text or '').to_user_data()
+
+    def parse_decoded_doc(self, doc):
+        """Convert a document which has already been decoded from the
+        response (a dictionary of field names to values, or lists of
+        values) using the schema, as parse_result_doc does for XML."""
+        d = {}
+        for name, value in named_list_items(doc):
+            field_class = self.result_field(name)
+            if isinstance(value, list):
+                d[name] = tuple(SolrFieldInstance.from_solr(field_class, v).to_user_data()
+                                for v in value)
+            else:
+                d[name] = SolrFieldInstance.from_solr(field_class, value).to_user_data()
+        return d
+
+    def result_field(self, name):
         field_class = self.match_field(name)
         if field_class is None and name == "score":
             field_class = SolrScoreField()
         elif field_class is None:
             raise SolrError("unexpected field found in result")
-        return name, SolrFieldInstance.from_solr(field_class, doc.text or '').to_user_data()
+        return field_class
 
 
 class SolrUpdate(object):
@@ -518,19 +651,25 @@ class SolrUpdate(object):
         self.schema = schema
         self.xml = self.add(docs)
 
-    def fields(self, name, values):
+    def solr_values(self, name, values):
         # values may be multivalued - so we treat that as the default case
         if not hasattr(values, "__iter__"):
             values = [values]
-        field_values = [self.schema.field_from_user_data(name, value) for value in values]
-        return [self.FIELD({'name':name}, field_value.to_solr())
-            for field_value in field_values]
+        return [self.schema.field_from_user_data(name, value).to_solr()
+            for value in values]
 
-    def doc(self, doc):
+    def fields(self, name, values):
+        return [self.FIELD({'name':name}, solr_value)
+            for solr_value in self.solr_values(name, values)]
+
+    def check_required_fields(self, doc):
         missing_fields = self.schema.missing_fields(doc.keys())
         if missing_fields:
             raise SolrError("These required fields are unspecified:\n %s" %
                             missing_fields)
+
+    def doc(self, doc):
+        self.check_required_fields(doc)
         if not doc:
             return self.DOC()
         else:
@@ -539,18 +678,127 @@ class SolrUpdate(object):
                                      for name, values in doc.items()]))
 
     def add(self, docs):
+        return self.ADD(*[self.doc(doc) for doc in self.dicts_from_docs(docs)])
+
+    def dicts_from_docs(self, docs):
         if hasattr(docs, "items") or not hasattr(docs, "__iter__"):
             # is a dictionary, or anything else except a list
             docs = [docs]
-        docs = [(doc if hasattr(doc, "items")
-                 else object_to_dict(doc, self.schema))
-                for doc in docs]
-        return self.ADD(*[self.doc(doc) for doc in docs])
+        for doc in docs:
+            yield doc if hasattr(doc, "items") else object_to_dict(doc, self.schema)
 
     def __str__(self):
         return lxml.etree.tostring(self.xml, encoding='utf-8')
 
 
+class SolrUpdateStream(SolrUpdate):
+    """An update message which is serialized incrementally.
+
+    Iterating over it yields the message in pieces, each holding at most
+    one document, so only one document's tree is ever held in memory
+    at once. This is suitable for sending as a chunked request body."""
+    def __init__(self, schema, docs):
+        self.schema = schema
+        self.docs = docs
+
+    def __iter__(self):
+        yield "<add>"
+        for doc in self.dicts_from_docs(self.docs):
+            yield lxml.etree.tostring(self.doc(doc), encoding='utf-8')
+        yield "</add>"
+
+    def __str__(self):
+        return "".join(self)
+
+
+class SolrJSONUpdate(SolrUpdateStream):
+    """An update message for Solr's JSON update handler. Like
+    SolrUpdateStream, it may be sent either whole or incrementally."""
+    def doc(self, doc):
+        self.check_required_fields(doc)
+        d = {}
+        for name, values in doc.items():
+            solr_values = self.solr_values(name, values)
+            d[name] = solr_values if hasattr(values, "__iter__") else solr_values[0]
+        return d
+
+    def __iter__(self):
+        separator = "["
+        for doc in self.dicts_from_docs(self.docs):
+            yield separator + json.dumps(self.doc(doc))
+            separator = ","
+        yield "]" if separator == "," else "[]"
+
+
+class SolrCSVUpdate(object):
+    """An update message for Solr's CSV update handler.
+
+    Documents are supplied as rows of values, in the order given by
+    field_names, and each value is converted according to the schema.
+    No per-document objects are built; iterating over the message
+    yields it one CSV line at a time. Multivalued fields may be given
+    a list of values, which are joined with split_separator and split
+    apart again by Solr."""
+    split_separator = "|"
+
+    def __init__(self, schema, rows, field_names):
+        self.schema = schema
+        self.rows = rows
+        self.field_names = list(field_names)
+        self.fields = []
+        for name in self.field_names:
+            field = schema.match_field(name)
+            if not field:
+                raise SolrError("No such field '%s' in current schema" % name)
+            self.fields.append(field)
+        missing_fields = schema.missing_fields(self.field_names)
+        if missing_fields:
+            raise SolrError("These required fields are unspecified:\n %s" %
+                            missing_fields)
+
+    def params(self):
+        params = {"header":"false",
+                  "fieldnames":",".join(self.field_names)}
+        for field_name, field in zip(self.field_names, self.fields):
+            if field.multi_valued:
+                params["f.%s.split" % field_name] = "true"
+                params["f.%s.separator" % field_name] = self.split_separator
+        return params
+
+    def solr_value(self, field, value):
+        return field.to_solr(field.from_user_data(value))
+
+    def row(self, row):
+        values = []
+        for field, value in zip(self.fields, row):
+            if value is None:
+                values.append("")
+            elif field.multi_valued:
+                if not hasattr(value, "__iter__"):
+                    value = [value]
+                solr_values = [self.solr_value(field, v) for v in value]
+                for v in solr_values:
+                    if self.split_separator in v:
+                        raise SolrError("Value '%s' for multivalued field '%s' contains '%s'"
+                                        % (v, field.name, self.split_separator))
+                values.append(self.split_separator.join(solr_values).encode('utf-8'))
+            else:
+                values.append(self.solr_value(field, value).encode('utf-8'))
+        return values
+
+    def __iter__(self):
+        buf = StringIO.StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        for row in self.rows:
+            writer.writerow(self.row(row))
+            yield buf.getvalue()
+            buf.seek(0)
+            buf.truncate()
+
+    def __str__(self):
+        return "".join(self)
+
+
 class SolrDelete(object):
     DELETE = E.delete
     ID = E.id
@@ -570,33 +818,13 @@ class SolrDelete(object):
         if hasattr(docs, "items") or not hasattr(docs, "__iter__"):
             # docs is a dictionary, or an object which is not a list
             docs = [docs]
-        doc_id_insts = [self.doc_id_from_doc(doc) for doc in docs]
-        return [self.ID(doc_id_inst.to_solr()) for doc_id_inst in doc_id_insts]
+        return [self.ID(doc_id) for doc_id in self.doc_ids(docs)]
+
+    def doc_ids(self, docs):
+        return [self.doc_id_from_doc(doc).to_solr() for doc in docs]
 
     def doc_id_from_doc(self, doc):
-        # Is this a dictionary, or an document object, or a thing
-        # that can be cast to a uniqueKey? (which could also be an
-        # arbitrary object.
-        if isinstance(doc, (basestring, int, long, float)):
-            # It's obviously not a document object, just coerce to appropriate type
-            doc_id = doc
-        elif hasattr(doc, "items"):
-            # It's obviously a dictionary
-            try:
-                doc_id = doc[self.schema.unique_key]
-            except KeyError:
-                raise SolrError("No unique key on this document")
-        else:
-            doc_id = get_attribute_or_callable(doc, self.schema.unique_key)
-            if doc_id is None:
-                # Well, we couldn't get an ID from it; let's try
-                # coercing the doc to the type of an ID field.
-                doc_id = doc
-        try:
-            doc_id_inst = self.schema.unique_field.instance_from_user_data(doc_id)
-        except SolrError:
-            raise SolrError("Could not parse argument as object or document id")
-        return doc_id_inst
+        return self.schema.doc_id_from_doc(doc)
 
     def delete_queries(self, queries):
         if not hasattr(queries, "__iter__"):
@@ -607,6 +835,29 @@ class SolrDelete(object):
         return lxml.etree.tostring(self.xml, encoding='utf-8')
 
 
+class SolrJSONDelete(SolrDelete):
+    """A delete message for Solr's JSON update handler."""
+    def __init__(self, schema, docs=None, queries=None):
+        self.schema = schema
+        self.deletions = []
+        if docs is not None:
+            self.deletions += self.delete_docs(docs)
+        if queries is not None:
+            self.deletions += self.delete_queries(queries)
+
+    def ID(self, doc_id):
+        return {"id":doc_id}
+
+    def QUERY(self, query):
+        return {"query":query}
+
+    def __str__(self):
+        # Each deletion is a separate "delete" key in the same object,
+        # which is how Solr expects multiple deletions to be expressed.
+        return "{%s}" % ",".join('"delete":%s' % json.dumps(deletion)
+                                 for deletion in self.deletions)
+
+
 class SolrFacetCounts(object):
     members= ["facet_dates", "facet_fields", "facet_queries"]
     def __init__(self, **kwargs):
@@ -628,6 +879,8 @@ class SolrResponse(object):
         details['responseHeader'] = dict(details['responseHeader'])
         for attr in ["QTime", "params", "status"]:
             setattr(self, attr, details['responseHeader'].get(attr))
+        # Set when Solr ran out of timeAllowed.
+        self.partial_results = bool(details['responseHeader'].get('partialResults'))
         if self.status != 0:
             raise ValueError("Response indicates an error")
 
@@ -652,6 +905,10 @@ class SolrResponse(object):
         else:
             self.more_like_this = None
 
+        # only returned for cursorMark queries
+        cursorNodes = doc.xpath("/response/str[@name='nextCursorMark']")
+        self.next_cursor_mark = cursorNodes[0].text if cursorNodes else None
+
         # can be computed by MoreLikeThisHandler
         termsNodes = doc.xpath("/response/*[@name='interestingTerms']")
         if len(termsNodes) == 1:
@@ -670,6 +927,121 @@ class SolrResponse(object):
         return self.result.docs[key]
 
 
+class DecodedSolrResponse(SolrResponse):
+    """A SolrResponse built from a response which has already been
+    decoded into Python objects (from javabin or JSON) rather than
+    from XML.
+
+    details is a sequence of (name, value) pairs, in which named lists
+    may be either sequences of pairs or dictionaries, and document
+    lists are dictionaries with numFound, start and docs keys."""
+    def __init__(self, schema, details):
+        self.schema = schema
+        details = dict(named_list_items(details))
+        header = dict(named_list_items(details['responseHeader']))
+        for attr in ["QTime", "params", "status"]:
+            setattr(self, attr, header.get(attr))
+        self.partial_results = bool(header.get('partialResults'))
+        if self.params is not None:
+            self.params = list(named_list_items(self.params))
+        if self.status != 0:
+            raise ValueError("Response indicates an error")
+
+        if 'grouped' in details:
+            self.result = SolrGroupResult.from_decoded(schema, details['grouped'])
+        else:
+            self.result = SolrResult.from_decoded(schema, 'response', details['response'])
+
+        facet_counts = details.get('facet_counts')
+        if facet_counts is not None:
+            details['facet_counts'] = list(named_list_items(facet_counts))
+        self.facet_counts = SolrFacetCounts.from_response(details)
+        self.highlighting = dict((k, dict(named_list_items(v)))
+                                 for k, v in named_list_items(details.get("highlighting", ())))
+        self.more_like_these = dict((name, SolrResult.from_decoded(schema, name, doclist))
+                                    for name, doclist in named_list_items(details.get("moreLikeThis", ())))
+        if len(self.more_like_these) == 1:
+            self.more_like_this = self.more_like_these.values()[0]
+        else:
+            self.more_like_this = None
+        self.interesting_terms = details.get("interestingTerms")
+        self.next_cursor_mark = details.get("nextCursorMark")
+
+
+class StreamingSolrResponse(object):
+    """A response whose documents are parsed one at a time, as they are
+    iterated over, rather than all at once.
+
+    Each document's elements are discarded as soon as it has been
+    converted, so the parsed tree and the converted documents never
+    have to be held in memory together. numFound and start are
+    available as soon as iteration has started; the header, facet
+    counts, highlighting and more-like-this results once it has
+    finished. The documents can only be iterated over once."""
+    def __init__(self, schema, xmlmsg, constructor=dict):
+        self.schema = schema
+        self.xmlmsg = xmlmsg
+        self.constructor = constructor
+        self.numFound = self.start = None
+        for attr in ["QTime", "params", "status", "facet_counts", "highlighting",
+                     "more_like_these", "more_like_this", "interesting_terms",
+                     "next_cursor_mark", "partial_results"]:
+            setattr(self, attr, None)
+
+    def __iter__(self):
+        if self.xmlmsg is None:
+            raise ValueError("A streamed response can only be iterated over once")
+        xmlmsg, self.xmlmsg = self.xmlmsg, None
+        details = {}
+        more_like_these = []
+        for event, node in lxml.etree.iterparse(StringIO.StringIO(xmlmsg),
+                                                 events=("start", "end")):
+            parent = node.getparent()
+            if parent is None:
+                continue
+            top_level = parent.getparent() is None
+            if event == "start":
+                if top_level and node.tag == "result" and node.get("name") == "response":
+                    self.numFound = int(node.attrib['numFound'])
+                    self.start = int(node.attrib['start'])
+                continue
+            if node.tag == "doc" and parent.tag == "result" \
+                    and parent.get("name") == "response" \
+                    and parent.getparent().getparent() is None:
+                doc = self.schema.parse_result_doc(node)
+                yield doc if self.constructor is dict else self.constructor(**doc)
+            elif not top_level:
+                continue
+            elif node.get("name") == "moreLikeThis":
+                more_like_these = [SolrResult(self.schema, n) for n in node.xpath("result")]
+            elif node.tag != "result":
+                name, value = value_from_node(node)
+                details[name] = value
+                if name == "responseHeader":
+                    self.set_header(dict(value))
+            node.clear()
+            while node.getprevious() is not None:
+                del parent[0]
+
+        self.facet_counts = SolrFacetCounts.from_response(details)
+        self.highlighting = dict((k, dict(v))
+                                 for k, v in details.get("highlighting", ()))
+        self.more_like_these = dict((n.name, n) for n in more_like_these)
+        if len(self.more_like_these) == 1:
+            self.more_like_this = self.more_like_these.values()[0]
+        self.interesting_terms = details.get("interestingTerms")
+        self.next_cursor_mark = details.get("nextCursorMark")
+
+    def set_header(self, header):
+        for attr in ["QTime", "params", "status"]:
+            setattr(self, attr, header.get(attr))
+        self.partial_results = bool(header.get('partialResults'))
+        if self.status != 0:
+            raise ValueError("Response indicates an error")
+        if self.params and ('group', 'true') in self.params:
+            raise ValueError("Grouped responses can't be streamed")
+
+
 class SolrResult(object):
     def __init__(self, schema, node):
         self.schema = schema
@@ -678,6 +1050,16 @@ class SolrResult(object):
         self.start = int(node.attrib['start'])
         self.docs = [schema.parse_result_doc(n) for n in node.xpath("doc")]
 
+    @classmethod
+    def from_decoded(cls, schema, name, doclist):
+        self = cls.__new__(cls)
+        self.schema = schema
+        self.name = name
+        self.numFound = int(doclist['numFound'])
+        self.start = int(doclist['start'])
+        self.docs = [schema.parse_decoded_doc(doc) for doc in doclist['docs']]
+        return self
+
     def __str__(self):
         return "%(numFound)s results found, starting at #%(start)s\n\n" % self.__dict__ + str(self.docs)
 
@@ -703,6 +1085,25 @@ class SolrGroupResult(object):
             self.groups[key] = group
             self.docs.extend(group.docs)
 
+    @classmethod
+    def from_decoded(cls, schema, grouped):
+        self = cls.__new__(cls)
+        self.schema = schema
+
+        self.field, group_details = list(named_list_items(grouped))[0]
+        group_details = dict(named_list_items(group_details))
+        self.numFound = group_details['ngroups']
+        self.matches = group_details['matches']
+        self.groups = {}
+        self.docs = []
+
+        for g in group_details['groups']:
+            g = dict(named_list_items(g))
+            group = SolrResult.from_decoded(schema, 'doclist', g['doclist'])
+            self.groups[g['groupValue']] = group
+            self.docs.extend(group.docs)
+        return self
+
     def __str__(self):
         return "%i matches found in %i groups" % (self.matches, self.numFound)
 
@@ -742,6 +1143,23 @@ def object_to_dict(o, schema):
                 d[name] = a
     return d
 
+def named_list_items(v):
+    """Decoded named lists may be either dictionaries or sequences of
+    (name, value) pairs; iterate over their pairs either way."""
+    if hasattr(v, "items"):
+        return v.items()
+    return v
+
+def json_named_list(pairs):
+    """object_pairs_hook for JSON responses (requested with json.nl=map),
+    which keeps objects in order as sequences of (name, value) pairs,
+    as named lists are decoded from XML. Document lists are the
+    exception, and become dictionaries."""
+    names = set(name for name, value in pairs)
+    if "numFound" in names and "docs" in names:
+        return dict(pairs)
+    return pairs
+
 def get_attribute_or_callable(o, name):
     try:
         a = getattr(o, name)
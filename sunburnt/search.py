@@ -1,7 +1,9 @@
 from __future__ import absolute_import
 
 import collections, copy, operator, re
+import Queue, sys, threading
 
+from .instrumentation import completion, phase
 from .schema import SolrError, SolrBooleanField, SolrUnicodeField, WildcardFieldInstance
 
 
@@ -363,7 +365,7 @@ class BaseSearch(object):
     option_modules = ('query_obj', 'filter_obj', 'paginator',
                       'more_like_this', 'highlighter', 'faceter',
                       'sorter', 'facet_querier', 'field_limiter',
-                      'grouper',)
+                      'grouper', 'response_formatter',)
 
     def _init_common_modules(self):
         self.query_obj = LuceneQuery(self.schema, u'q')
@@ -375,6 +377,7 @@ class BaseSearch(object):
         self.field_limiter = FieldLimitOptions(self.schema)
         self.facet_querier = FacetQueryOptions(self.schema)
         self.grouper = GroupOptions(self.schema)
+        self.response_formatter = ResponseFormatOptions(self.schema)
 
     def clone(self):
         return self.__class__(interface=self.interface, original=self)
@@ -466,6 +469,11 @@ class BaseSearch(object):
         newself.field_limiter.update(fields, score, all_fields)
         return newself
 
+    def response_format(self, wt):
+        newself = self.clone()
+        newself.response_formatter.update(wt)
+        return newself
+
     def options(self):
         options = {}
         for option_module in self.option_modules:
@@ -586,9 +594,124 @@ class SolrSearch(BaseSearch):
             options['q'] = '*:*' # search everything
         return options
 
-    def execute(self, constructor=dict):
-        result = self.interface.search(**self.options())
-        return self.transform_result(result, constructor)
+    def execute(self, constructor=dict, deadline=None):
+        """Run the query. If deadline (a time.time() value) is given,
+        Solr is asked to stop searching by then (with timeAllowed), and
+        DeadlineExceeded is raised if no response has arrived by then."""
+        trace = self.interface.new_trace('select')
+        with completion(trace):
+            with phase(trace, 'build_params'):
+                options = self.options()
+            result = self.interface.search(deadline=deadline, trace=trace, **options)
+            with phase(trace, 'transform'):
+                return self.transform_result(result, constructor)
+
+    def submit(self, constructor=dict, deadline=None):
+        """As execute(), but runs the query on the interface's thread
+        pool, immediately returning a concurrent.futures.Future for the
+        response."""
+        return self.interface.submit(self.execute, constructor, deadline)
+
+    def cursor(self, rows=1000, constructor=dict):
+        """Iterate over every result, rows at a time, using Solr's
+        cursorMark deep paging, so that each page costs the same however
+        far through the results it is. The unique key is added to the
+        sort as a tiebreak if it isn't there already."""
+        unique_key = self.schema.unique_key
+        if unique_key is None:
+            raise SolrError("Cursors need a uniqueKey in the schema")
+        newself = self.paginate(rows=rows)
+        if newself.paginator.start:
+            raise SolrError("Cursors can't be combined with a pagination start")
+        if unique_key not in [field for order, field in newself.sorter.fields]:
+            newself.sorter.update(unique_key)
+        return self._follow_cursor(newself.options(), constructor)
+
+    def _follow_cursor(self, options, constructor):
+        cursor_mark = "*"
+        while True:
+            options['cursorMark'] = cursor_mark
+            response = self.interface.search(**options)
+            for doc in self.transform_result(response, constructor).result.docs:
+                yield doc
+            if response.next_cursor_mark is None:
+                raise SolrError("No nextCursorMark in response; does this Solr support cursors?")
+            if response.next_cursor_mark == cursor_mark:
+                break
+            cursor_mark = response.next_cursor_mark
+
+    def __iter__(self):
+        return self.prefetch()
+
+    def prefetch(self, page_size=100, read_ahead=1, constructor=dict):
+        """Iterate over every result, fetching page_size results at a
+        time. The pages are fetched by a background thread, which keeps
+        up to read_ahead pages ahead of the caller, so that the next page
+        is on its way while the caller works through this one. A start
+        or rows set with paginate() bounds the results iterated over.
+
+        The background thread shares the interface's connection with the
+        caller, which must therefore be (or is made) a pool of at least
+        two connections, as for execute_many()."""
+        if page_size < 1:
+            raise ValueError("page_size must be 1 or greater")
+        if read_ahead < 1:
+            raise ValueError("read_ahead must be 1 or greater")
+        start = self.paginator.start or 0
+        if self.paginator.rows is not None:
+            stop = start + self.paginator.rows
+        else:
+            stop = None
+        self.interface.conn.ensure_pool(2)
+        pages = Queue.Queue(read_ahead)
+        stopped = threading.Event()
+        thread = threading.Thread(target=self._fetch_pages, name="sunburnt-prefetch",
+            args=(start, stop, page_size, constructor, pages, stopped))
+        thread.daemon = True
+        thread.start()
+        try:
+            while True:
+                docs, exc_info = pages.get()
+                if exc_info is not None:
+                    raise exc_info[0], exc_info[1], exc_info[2]
+                if docs is None:
+                    return
+                for doc in docs:
+                    yield doc
+        finally:
+            # Stop fetching, if the caller stopped iterating early.
+            stopped.set()
+
+    def _fetch_pages(self, start, stop, page_size, constructor, pages, stopped):
+        def put(item):
+            # Wait for room in the queue, unless iteration has stopped.
+            while not stopped.is_set():
+                try:
+                    pages.put(item, timeout=0.1)
+                    return True
+                except Queue.Full:
+                    pass
+            return False
+        try:
+            while stop is None or start < stop:
+                rows = page_size if stop is None else min(page_size, stop - start)
+                response = self.paginate(start=start, rows=rows).execute(constructor)
+                docs = response.result.docs
+                if docs and not put((docs, None)):
+                    return
+                start += len(docs)
+                if len(docs) < rows or start >= response.result.numFound:
+                    break
+        except Exception:
+            put((None, sys.exc_info()))
+            return
+        put((None, None))
+
+    def iterate(self, constructor=dict):
+        """Execute the query, returning a StreamingSolrResponse which
+        yields each result as it is parsed, for large pages of results
+        which needn't all be held in memory at once."""
+        return self.interface.stream_search(constructor=constructor, **self.options())
 
 
 class MltSolrSearch(BaseSearch):
@@ -635,9 +758,18 @@ class MltSolrSearch(BaseSearch):
             options['stream.url'] = self.url
         return options
 
-    def execute(self, constructor=dict):
-        result = self.interface.mlt_search(content=self.content, **self.options())
-        return self.transform_result(result, constructor)
+    def execute(self, constructor=dict, deadline=None):
+        trace = self.interface.new_trace('mlt')
+        with completion(trace):
+            with phase(trace, 'build_params'):
+                options = self.options()
+            result = self.interface.mlt_search(content=self.content, deadline=deadline, trace=trace, **options)
+            with phase(trace, 'transform'):
+                return self.transform_result(result, constructor)
+
+    def submit(self, constructor=dict, deadline=None):
+        """As execute(), but returns a concurrent.futures.Future."""
+        return self.interface.submit(self.execute, constructor, deadline)
 
 
 class Options(object):
@@ -1016,6 +1148,23 @@ class FieldLimitOptions(Options):
         return opts
 
 
+class ResponseFormatOptions(Options):
+    def __init__(self, schema, original=None):
+        self.schema = schema
+        if original is None:
+            self.wt = None
+        else:
+            self.wt = original.wt
+
+    def update(self, wt):
+        self.wt = wt
+
+    def options(self):
+        if self.wt is not None:
+            return {'wt':self.wt}
+        return {}
+
+
 class FacetQueryOptions(Options):
     def __init__(self, schema, original=None):
         self.schema = schema
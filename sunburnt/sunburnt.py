@@ -1,41 +1,188 @@
 from __future__ import absolute_import
 
 import cgi
+import functools
 import cStringIO as StringIO
 from itertools import islice
 import logging
-import socket, time, urllib, urlparse
+import socket, threading, time, urllib, urlparse
+import zlib
 import warnings
 
-
+try:
+    from concurrent import futures
+except ImportError:
+    warnings.warn(
+        "concurrent.futures not found; AsyncSolrInterface, ShardedSolrInterface, "
+        "concurrent add(), execute_many() and submit() are unavailable",
+        ImportWarning)
+    futures = None
+
+from .cache import QueryCache, SchemaCache, SingleFlight
+from .cluster import LoadBalancedConnection
+from .instrumentation import completion, phase
 from .schema import SolrSchema, SolrError
 from .search import LuceneQuery, MltSolrSearch, SolrSearch, params_from_dict
+from .transport import ChunkedBody, CircuitOpenError, ConnectionPool, DeadlineExceeded, RetryPolicy, \
+    decompress_content, gzip_iter, gzip_string, send_once, socket_timeout
 
 MAX_LENGTH_GET_URL = 2048
 # Jetty default is 4096; Tomcat default is 8192; picking 2048 to be conservative.
 
+
+class SolrUpdateError(SolrError):
+    """One or more chunks of an update failed. errors is a list of
+    (chunk number, exception) pairs, in chunk order."""
+    def __init__(self, errors):
+        self.errors = errors
+        super(SolrUpdateError, self).__init__(
+            "%s chunk(s) failed to update: %s" % (len(errors),
+                ", ".join("#%s (%s)" % (i, e) for i, e in errors)))
+
 class SolrConnection(object):
-    def __init__(self, url, http_connection, retry_timeout, max_length_get_url):
+    def __init__(self, url, http_connection, retry_timeout, max_length_get_url, pool_size=None, pool_timeout=None, cache=None, gzip_min_size=None, retry_policy=None, circuit_breaker=None):
         if http_connection:
             self.http_connection = http_connection
+        elif pool_size:
+            self.http_connection = ConnectionPool(pool_size, timeout=pool_timeout)
         else:
             import httplib2
             self.http_connection = httplib2.Http()
+        # Whether the connection is our own default, which ensure_pool()
+        # may replace.
+        self.default_http_connection = not (http_connection or pool_size)
+        self.pool_timeout = pool_timeout
         self.url = url.rstrip("/") + "/"
         self.update_url = self.url + "update/"
+        self.update_urls = {
+            'xml': self.update_url,
+            'json': self.update_url + "json",
+            'csv': self.update_url + "csv",
+        }
         self.select_url = self.url + "select/"
         self.mlt_url = self.url + "mlt/"
         self.retry_timeout = retry_timeout
+        if retry_policy is None and retry_timeout >= 0:
+            retry_policy = RetryPolicy.from_retry_timeout(retry_timeout)
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
         self.max_length_get_url = max_length_get_url
+        self.cache = cache
+        self.gzip_min_size = gzip_min_size
+
+    def ensure_pool(self, size):
+        """Make sure that size threads can make requests at once. The
+        default httplib2.Http isn't thread-safe, so it is replaced with
+        a ConnectionPool of that size; otherwise the http_connection
+        must already be a ConnectionPool at least that big."""
+        http = self.http_connection
+        if isinstance(http, ConnectionPool) and http.size >= size:
+            return
+        if not self.default_http_connection:
+            raise ValueError("%s concurrent requests to %s need a pool_size (or a ConnectionPool) "
+                             "of at least %s" % (size, self.url, size))
+        self.http_connection = ConnectionPool(size, timeout=self.pool_timeout)
 
     def request(self, *args, **kwargs):
-        try:
-            return self.http_connection.request(*args, **kwargs)
-        except socket.error:
-            if self.retry_timeout < 0:
+        """Make a request with the signature of httplib2.Http.request,
+        retrying according to the retry policy.
+
+        Only GET requests are treated as idempotent reads, unless
+        idempotent is passed explicitly (as it is for POSTed queries).
+
+        If deadline (a time.time() value) is given, the socket timeout
+        is set to the time remaining, and no retry is made which would
+        have to wait past it; DeadlineExceeded is raised if it passes
+        before there is a response."""
+        idempotent = kwargs.pop('idempotent', None)
+        deadline = kwargs.pop('deadline', None)
+        if idempotent is None:
+            method = kwargs.get('method', args[1] if len(args) > 1 else 'GET')
+            idempotent = method in ('GET', 'HEAD')
+        headers = dict(kwargs.get('headers') or {})
+        headers.setdefault('Accept-Encoding', 'gzip')
+        kwargs['headers'] = headers
+        policy = self.retry_policy
+        # A streamed body can't be sent a second time.
+        retryable = policy is not None and not isinstance(kwargs.get('body'), ChunkedBody)
+        attempt = 0
+        while True:
+            if deadline is not None and deadline <= time.time():
+                raise DeadlineExceeded("Deadline passed before contacting %s" % self.url)
+            if self.circuit_breaker is not None and not self.circuit_breaker.allow():
+                raise CircuitOpenError("Not contacting %s: too many recent failures" % self.url)
+            try:
+                r, c = self.send(deadline, *args, **kwargs)
+            except socket.error, e:
+                if isinstance(e, socket.timeout) and self.too_late(deadline, 0):
+                    # Our own socket timeout, set from the deadline,
+                    # rather than a failure of the server.
+                    raise DeadlineExceeded("Deadline passed waiting for %s" % self.url)
+                self.record_outcome(False)
+                if not (retryable and policy.should_retry(attempt, idempotent)):
+                    raise
+                delay = policy.delay(attempt)
+                if self.too_late(deadline, delay):
+                    raise
+            except Exception:
+                # Anything else which goes wrong in the transport (such
+                # as httplib.BadStatusLine) is a failure too, but not a
+                # document that couldn't be serialized.
+                body = kwargs.get('body')
+                if not (isinstance(body, ChunkedBody) and body.error is not None):
+                    self.record_outcome(False)
                 raise
-            time.sleep(self.retry_timeout)
-            return self.http_connection.request(*args, **kwargs)
+            else:
+                self.record_outcome(r.status < 500)
+                if not (retryable and r.status in policy.retry_statuses
+                        and policy.should_retry(attempt, idempotent)):
+                    return r, decompress_content(r, c)
+                delay = policy.delay(attempt)
+                if self.too_late(deadline, delay):
+                    return r, decompress_content(r, c)
+            time.sleep(delay)
+            attempt += 1
+
+    def send(self, deadline, *args, **kwargs):
+        request = self.http_connection.request
+        if isinstance(kwargs.get('body'), ChunkedBody) \
+                and not isinstance(self.http_connection, ConnectionPool):
+            request = functools.partial(send_once, self.http_connection)
+        if deadline is None:
+            return request(*args, **kwargs)
+        timeout = max(deadline - time.time(), 0.001)
+        if isinstance(self.http_connection, ConnectionPool):
+            return request(*args, timeout=timeout, **kwargs)
+        with socket_timeout(self.http_connection, timeout):
+            return request(*args, **kwargs)
+
+    @staticmethod
+    def too_late(deadline, delay):
+        """Whether a retry after delay would start past deadline."""
+        return deadline is not None and time.time() + delay >= deadline
+
+    def record_outcome(self, success):
+        if self.circuit_breaker is None:
+            return
+        if success:
+            self.circuit_breaker.record_success()
+        else:
+            self.circuit_breaker.record_failure()
+
+    def compress_body(self, body, headers):
+        """Gzip body, if compression is turned on and it's big enough
+        to be worth it, adding a Content-Encoding header to headers.
+        Iterable bodies are always compressed (as they're streamed)."""
+        if self.gzip_min_size is None or not body:
+            return body
+        if isinstance(body, basestring):
+            if len(body) < self.gzip_min_size:
+                return body
+            body = gzip_string(body)
+        else:
+            body = gzip_iter(body)
+        headers['Content-Encoding'] = 'gzip'
+        return body
 
     def commit(self, waitFlush=True, waitSearcher=True, expungeDeletes=False):
         response = self.update('<commit/>',
@@ -52,13 +199,24 @@ class SolrConnection(object):
     def rollback(self):
         response = self.update("<rollback/>")
 
-    def update(self, update_doc, commit=None, optimize=None, waitFlush=None, waitSearcher=None, expungeDeletes=None, maxSegments=None):
+    update_content_types = {
+        'xml': "text/xml; charset=utf-8",
+        'json': "application/json; charset=utf-8",
+        'csv': "text/csv; charset=utf-8",
+    }
+
+    def update(self, update_doc, commit=None, optimize=None, waitFlush=None, waitSearcher=None, expungeDeletes=None, maxSegments=None, update_format='xml', params=None):
         body = update_doc
         if body:
-            headers = {"Content-Type":"text/xml; charset=utf-8"}
+            headers = {"Content-Type":self.update_content_types[update_format]}
         else:
             headers = {}
-        extra_params = {}
+        body = self.compress_body(body, headers)
+        if body and not isinstance(body, basestring):
+            # An iterable of strings, which we stream to Solr.
+            body = ChunkedBody(body)
+            headers.update(body.headers)
+        extra_params = dict(params or {})
         if commit is not None:
             extra_params['commit'] = "true" if commit else "false"
         if optimize is not None:
@@ -71,63 +229,138 @@ class SolrConnection(object):
             extra_params['expungeDeletes'] = "true" if expungeDeletes else "false"
         if maxSegments is not None:
             extra_params['maxSegments'] = str(int(maxSegments))
+        update_url = self.update_urls[update_format]
         if extra_params:
-            url = "%s?%s" % (self.update_url, urllib.urlencode(extra_params))
+            url = "%s?%s" % (update_url, urllib.urlencode(extra_params))
         else:
-            url = self.update_url
-        r, c = self.request(url, method="POST", body=body,
-                            headers=headers)
+            url = update_url
+        try:
+            r, c = self.request(url, method="POST", body=body,
+                                headers=headers)
+        finally:
+            # Even a failed update may have changed the index.
+            if self.cache is not None:
+                self.cache.invalidate()
         if r.status != 200:
             raise SolrError(r, c)
 
-    def select(self, params):
-        qs = urllib.urlencode(params)
-        url = "%s?%s" % (self.select_url, qs)
-        if len(url) > self.max_length_get_url:
-            warnings.warn("Long query URL encountered - POSTing instead of GETting. This query will not be cached at the HTTP layer")
-            method = "POST"
-        else:
-            method = "GET"
-        r, c = self.request(url, method=method)
-        if r.status != 200:
-            raise SolrError(r, c)
-        return c
+    def select(self, params, deadline=None, trace=None):
+        with phase(trace, 'encode_url'):
+            qs = urllib.urlencode(params)
+            url = "%s?%s" % (self.select_url, qs)
+            if len(url) > self.max_length_get_url:
+                warnings.warn("Long query URL encountered - POSTing instead of GETting. This query will not be cached at the HTTP layer")
+                headers = {"Content-Type": "application/x-www-form-urlencoded; charset=utf-8"}
+                kwargs = {'uri': self.select_url, 'method': "POST", 'idempotent': True,
+                    'body': self.compress_body(qs, headers), 'headers': headers}
+            else:
+                kwargs = {'uri': url, 'method': "GET"}
+        return self.fetch_query(("select", tuple(params)), kwargs, deadline, trace)
 
-    def mlt(self, params, content=None):
+    def mlt(self, params, content=None, deadline=None, trace=None):
         """Perform a MoreLikeThis query using the content specified
         There may be no content if stream.url is specified in the params.
         """
-        qs = urllib.urlencode(params)
-        base_url = "%s?%s" % (self.mlt_url, qs)
-        if content is None:
-            kwargs = {'uri': base_url, 'method': "GET"}
-        else:
-            get_url = "%s&stream.body=%s" % (base_url, urllib.quote_plus(content))
-            if len(get_url) <= self.max_length_get_url:
-                kwargs = {'uri': get_url, 'method': "GET"}
+        with phase(trace, 'encode_url'):
+            qs = urllib.urlencode(params)
+            base_url = "%s?%s" % (self.mlt_url, qs)
+            if content is None:
+                kwargs = {'uri': base_url, 'method': "GET"}
             else:
-                kwargs = {'uri': base_url, 'method': "POST",
-                    'body': content, 'headers': {"Content-Type": "text/plain; charset=utf-8"}}
-        r, c = self.request(**kwargs)
-        if r.status != 200:
-            raise SolrError(r, c)
-        return c
+                get_url = "%s&stream.body=%s" % (base_url, urllib.quote_plus(content))
+                if len(get_url) <= self.max_length_get_url:
+                    kwargs = {'uri': get_url, 'method': "GET"}
+                else:
+                    headers = {"Content-Type": "text/plain; charset=utf-8"}
+                    kwargs = {'uri': base_url, 'method': "POST", 'idempotent': True,
+                        'body': self.compress_body(content, headers), 'headers': headers}
+        return self.fetch_query(("mlt", tuple(params), content), kwargs, deadline, trace)
+
+    def fetch_query(self, key, kwargs, deadline=None, trace=None):
+        """Make the query request described by kwargs (or answer it from
+        the cache, under key), returning the response body."""
+        if trace is not None:
+            trace.method = kwargs['method']
+            trace.url = kwargs['uri']
+            trace.posted = kwargs['method'] == "POST"
+            trace.request_bytes = len(kwargs['uri']) + len(kwargs.get('body') or '')
+            trace.cached = True
+        def fetch():
+            with phase(trace, 'http'):
+                r, c = self.request(deadline=deadline, **kwargs)
+            if trace is not None:
+                trace.cached = False
+                trace.status = r.status
+                trace.response_bytes = len(c)
+            if r.status != 200:
+                raise SolrError(r, c)
+            return c
+        return self.cached(key, fetch, deadline)
+
+    def cached(self, key, fetch, deadline=None):
+        # A response to a query with a deadline may be incomplete.
+        if self.cache is None or deadline is not None:
+            return fetch()
+        return self.cache.fetch(key, fetch)
 
 
 class SolrInterface(object):
     readable = True
     writeable = True
     remote_schema_file = "admin/file/?file=schema.xml"
-    def __init__(self, url, schemadoc=None, http_connection=None, mode='', retry_timeout=-1, max_length_get_url=MAX_LENGTH_GET_URL):
-        self.conn = SolrConnection(url, http_connection, retry_timeout, max_length_get_url)
+    response_formats = ('xml', 'json', 'javabin')
+    def __init__(self, url, schemadoc=None, http_connection=None, mode='', retry_timeout=-1, max_length_get_url=MAX_LENGTH_GET_URL, pool_size=None, pool_timeout=None, update_format='xml', response_format='xml', cache_size=None, cache_ttl=None, schema_cache_dir=None, schema_cache_ttl=None, gzip_min_size=None, retry_policy=None, circuit_breaker=None, load_balancing='least_outstanding', health_check_interval=None, hedge_percentile=None, hedge_budget=0.05, instrumentation=None, max_workers=10, coalesce=False, cache=None):
+        self.instrumentation = instrumentation
+        self.single_flight = SingleFlight() if coalesce else None
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_lock = threading.Lock()
+        if cache is not None:
+            # A QueryCache shared with other interfaces.
+            self.cache = cache
+        elif cache_size:
+            self.cache = QueryCache(cache_size, cache_ttl)
+        else:
+            self.cache = None
+        if isinstance(url, basestring):
+            self.conn = SolrConnection(url, http_connection, retry_timeout, max_length_get_url, pool_size, pool_timeout, self.cache, gzip_min_size, retry_policy, circuit_breaker)
+        else:
+            # Replicas of the same core; each gets its own circuit breaker.
+            self.conn = LoadBalancedConnection(
+                [SolrConnection(u, http_connection, retry_timeout, max_length_get_url, pool_size, pool_timeout, self.cache, gzip_min_size, retry_policy,
+                                circuit_breaker.copy() if circuit_breaker else None)
+                 for u in url],
+                policy=load_balancing, health_check_interval=health_check_interval,
+                hedge_percentile=hedge_percentile, hedge_budget=hedge_budget)
         self.schemadoc = schemadoc
+        if schema_cache_dir:
+            self.schema_cache = SchemaCache(schema_cache_dir, schema_cache_ttl)
+        else:
+            self.schema_cache = None
+        if update_format not in ('xml', 'json'):
+            raise ValueError("update_format must be 'xml' or 'json'")
+        self.update_format = update_format
+        if response_format not in self.response_formats:
+            raise ValueError("response_format must be one of %s" % list(self.response_formats))
+        self.response_format = response_format
         if mode == 'r':
             self.writeable = False
         elif mode == 'w':
             self.readable = False
-        self.init_schema()
-
-    def init_schema(self):
+        self.init_schema(revalidate=False)
+
+    def init_schema(self, revalidate=True):
+        if isinstance(self.schemadoc, SolrSchema):
+            # Already parsed, for instance shared with another interface.
+            self.schema = self.schemadoc
+            return
+        if self.schema_cache is not None and not self.schemadoc:
+            # The cache's ttl only applies at startup; asking to
+            # re-read the schema always checks with Solr.
+            self.schema = self.schema_cache.fetch(
+                urlparse.urljoin(self.conn.url, self.remote_schema_file),
+                self.conn.request, revalidate=revalidate)
+            return
         if self.schemadoc:
             schemadoc = self.schemadoc
         else:
@@ -138,16 +371,133 @@ class SolrInterface(object):
             schemadoc = StringIO.StringIO(c)
         self.schema = SolrSchema(schemadoc)
 
-    def add(self, docs, chunk=100, commit=None, waitFlush=None, waitSearcher=None):
+    def add(self, docs, chunk=100, commit=None, waitFlush=None, waitSearcher=None, concurrency=1, stream=False):
         if not self.writeable:
             raise TypeError("This Solr instance is only for reading")
         if hasattr(docs, "items") or not hasattr(docs, "__iter__"):
             docs = [docs]
+        if concurrency > 1:
+            return self.add_concurrently(docs, chunk, concurrency,
+                commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher, stream=stream)
+        if stream and chunk is None:
+            # Stream everything as a single update, without ever
+            # holding more than one document at a time.
+            update_message = self.schema.make_update(docs, stream=True, update_format=self.update_format)
+            self.conn.update(update_message, commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher, update_format=self.update_format)
+            return
         # to avoid making messages too large, we break the message every
         # chunk docs.
         for doc_chunk in grouper(docs, chunk):
-            update_message = self.schema.make_update(doc_chunk)
-            self.conn.update(str(update_message), commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher)
+            update_message = self.schema.make_update(doc_chunk, stream=stream, update_format=self.update_format)
+            if not stream:
+                update_message = str(update_message)
+            self.conn.update(update_message, commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher, update_format=self.update_format)
+
+    def add_concurrently(self, docs, chunk, concurrency, commit=None, waitFlush=None, waitSearcher=None, stream=False):
+        """Serialize docs in chunks, keeping up to concurrency update
+        requests in flight at once.
+
+        Chunks may arrive at Solr in any order, so rather than committing
+        with every chunk, a single commit is issued once they have all
+        succeeded. If any chunk fails, no further chunks are sent, and a
+        SolrUpdateError listing every failed chunk is raised once the
+        requests in flight have finished.
+
+        As for execute_many(), the connection must be (or is made) a
+        pool of at least concurrency connections.
+        """
+        if futures is None:
+            raise EnvironmentError("concurrent.futures not available, cannot add concurrently")
+        self.conn.ensure_pool(concurrency)
+        chunk_commit = False if commit is False else None
+        errors = []
+        executor = futures.ThreadPoolExecutor(concurrency)
+        try:
+            in_flight = {}
+            for i, doc_chunk in enumerate(grouper(docs, chunk)):
+                if stream:
+                    # Serialization happens as the body is sent, in
+                    # the worker thread.
+                    update_message = self.schema.make_update(doc_chunk, stream=True, update_format=self.update_format)
+                else:
+                    try:
+                        update_message = str(self.schema.make_update(doc_chunk, update_format=self.update_format))
+                    except SolrError, e:
+                        errors.append((i, e))
+                        break
+                future = executor.submit(self.conn.update, update_message,
+                    commit=chunk_commit, update_format=self.update_format)
+                in_flight[future] = i
+                if len(in_flight) >= concurrency:
+                    done, _ = futures.wait(in_flight, return_when=futures.FIRST_COMPLETED)
+                    errors.extend(self._chunk_errors(done, in_flight))
+                    if errors:
+                        break
+            done, _ = futures.wait(in_flight)
+            errors.extend(self._chunk_errors(done, in_flight))
+        finally:
+            executor.shutdown()
+        if errors:
+            raise SolrUpdateError(sorted(errors))
+        if commit:
+            self.conn.commit(waitFlush=waitFlush, waitSearcher=waitSearcher)
+
+    @staticmethod
+    def _chunk_errors(done, in_flight):
+        errors = []
+        for future in done:
+            i = in_flight.pop(future)
+            if future.exception() is not None:
+                errors.append((i, future.exception()))
+        return errors
+
+    def add_csv(self, rows, fields, commit=None, waitFlush=None, waitSearcher=None):
+        """Bulk-load flat documents through Solr's CSV update handler.
+
+        rows is an iterable of sequences of values, one per name in
+        fields. The rows are converted and streamed to Solr one at a
+        time, as a single update. If a row can't be converted, the
+        update is abandoned before it is complete, so none of the rows
+        are loaded.
+        """
+        if not self.writeable:
+            raise TypeError("This Solr instance is only for reading")
+        update_message = self.schema.make_csv_update(rows, fields)
+        self.conn.update(update_message, commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher,
+                         update_format='csv', params=update_message.params())
+
+    @property
+    def executor(self):
+        """The thread pool used by submit(), created when first needed,
+        along with a connection pool for its threads (see
+        execute_many())."""
+        with self._executor_lock:
+            if self._executor is None:
+                if futures is None:
+                    raise EnvironmentError("concurrent.futures not available, cannot submit requests")
+                self.conn.ensure_pool(self.max_workers)
+                self._executor = futures.ThreadPoolExecutor(self.max_workers)
+            return self._executor
+
+    def submit(self, fn, *args, **kwargs):
+        """Call fn(*args, **kwargs) on this interface's thread pool,
+        returning a concurrent.futures.Future for its result."""
+        return self.executor.submit(fn, *args, **kwargs)
+
+    def submit_add(self, docs, **kwargs):
+        """As add(), but returns a Future immediately."""
+        return self.submit(self.add, docs, **kwargs)
+
+    def submit_delete(self, docs=None, queries=None, **kwargs):
+        """As delete(), but returns a Future immediately."""
+        return self.submit(self.delete, docs, queries, **kwargs)
+
+    def shutdown(self, wait=True):
+        """Shut down the thread pool used by submit(), if there is one."""
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait)
 
     def delete(self, docs=None, queries=None, commit=None, waitFlush=None, waitSearcher=None):
         if not self.writeable:
@@ -156,8 +506,8 @@ class SolrInterface(object):
             raise SolrError("No docs or query specified for deletion")
         elif docs is not None and (hasattr(docs, "items") or not hasattr(docs, "__iter__")):
             docs = [docs]
-        delete_message = self.schema.make_delete(docs, queries)
-        self.conn.update(str(delete_message), commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher)
+        delete_message = self.schema.make_delete(docs, queries, update_format=self.update_format)
+        self.conn.update(str(delete_message), commit=commit, waitFlush=waitFlush, waitSearcher=waitSearcher, update_format=self.update_format)
 
     def commit(self, *args, **kwargs):
         if not self.writeable:
@@ -180,11 +530,84 @@ class SolrInterface(object):
         # When deletion is fixed to escape query strings, this will need fixed.
         self.delete(queries=self.Q(**{"*":"*"}))
 
-    def search(self, **kwargs):
+    def search(self, deadline=None, trace=None, **kwargs):
         if not self.readable:
             raise TypeError("This Solr instance is only for writing")
+        own_trace = trace is None
+        if own_trace:
+            trace = self.new_trace('select')
+        # Only a trace started here is completed here.
+        with completion(trace if own_trace else None):
+            with phase(trace, 'build_params'):
+                wt = self.set_response_format(kwargs)
+                self.set_time_allowed(kwargs, deadline)
+                params = params_from_dict(**kwargs)
+            c = self.coalesced(("select", tuple(params)), trace,
+                lambda: self.conn.select(params, deadline=deadline, trace=trace))
+            return self.parse_response(c, wt, trace)
+
+    def execute_many(self, searches, max_concurrency=10, constructor=dict, deadline=None):
+        """Execute several independent searches at once, keeping up to
+        max_concurrency of them in flight, and return their responses in
+        the same order. A search which fails doesn't stop the others; the
+        exception it raised is returned in place of its response.
+
+        The searches run in separate threads, so unless this interface
+        has a connection pool (pool_size) at least that large, its
+        default connection is replaced with one; ValueError is raised
+        if it was given some other http_connection.
+        """
+        if futures is None:
+            raise EnvironmentError("concurrent.futures not available, cannot execute searches concurrently")
+        searches = list(searches)
+        if not searches:
+            return []
+        concurrency = min(max_concurrency, len(searches))
+        self.conn.ensure_pool(concurrency)
+        executor = futures.ThreadPoolExecutor(concurrency)
+        try:
+            in_flight = [executor.submit(search.execute, constructor, deadline)
+                         for search in searches]
+            futures.wait(in_flight)
+        finally:
+            executor.shutdown()
+        return [f.exception() or f.result() for f in in_flight]
+
+    def coalesced(self, key, trace, fetch):
+        """Return the body fetched by fetch, sharing it with any
+        identical query already in flight if coalescing is on. Bodies
+        rather than responses are shared, since each caller may modify
+        its response."""
+        if self.single_flight is None:
+            return fetch()
+        c, shared = self.single_flight.fetch(key, fetch)
+        if shared and trace is not None:
+            trace.coalesced = True
+        return c
+
+    def new_trace(self, kind):
+        """A RequestTrace for a new query, if it's being instrumented."""
+        if self.instrumentation is None:
+            return None
+        return self.instrumentation.trace(kind)
+
+    def parse_response(self, c, wt, trace):
+        with phase(trace, 'parse'):
+            response = self.schema.parse_response(c, wt)
+        if trace is not None:
+            trace.qtime = response.QTime
+        return response
+
+    def stream_search(self, constructor=dict, **kwargs):
+        """Like search(), but returns a StreamingSolrResponse, which
+        converts documents one at a time as it is iterated over."""
+        if not self.readable:
+            raise TypeError("This Solr instance is only for writing")
+        # Only XML responses can be parsed incrementally.
+        if kwargs.pop('wt', 'xml') != 'xml':
+            raise ValueError("Only XML responses can be streamed")
         params = params_from_dict(**kwargs)
-        return self.schema.parse_response(self.conn.select(params))
+        return self.schema.stream_response(self.conn.select(params), constructor)
 
     def query(self, *args, **kwargs):
         if not self.readable:
@@ -195,11 +618,43 @@ class SolrInterface(object):
         else:
             return q
 
-    def mlt_search(self, content=None, **kwargs):
+    def mlt_search(self, content=None, deadline=None, trace=None, **kwargs):
         if not self.readable:
             raise TypeError("This Solr instance is only for writing")
-        params = params_from_dict(**kwargs)
-        return self.schema.parse_response(self.conn.mlt(params, content=content))
+        own_trace = trace is None
+        if own_trace:
+            trace = self.new_trace('mlt')
+        # Only a trace started here is completed here.
+        with completion(trace if own_trace else None):
+            with phase(trace, 'build_params'):
+                wt = self.set_response_format(kwargs)
+                self.set_time_allowed(kwargs, deadline)
+                params = params_from_dict(**kwargs)
+            c = self.coalesced(("mlt", tuple(params), content), trace,
+                lambda: self.conn.mlt(params, content=content, deadline=deadline, trace=trace))
+            return self.parse_response(c, wt, trace)
+
+    @staticmethod
+    def set_time_allowed(params, deadline):
+        # Ask Solr to stop searching by the deadline too, returning
+        # whatever it has found so far (flagged as partialResults).
+        if deadline is not None:
+            remaining = int((deadline - time.time()) * 1000)
+            params.setdefault('timeAllowed', max(remaining, 1))
+
+    def set_response_format(self, params):
+        # Leave XML responses with Solr's default wt, so that
+        # the params (and so any HTTP caching) are unchanged.
+        wt = params.get('wt', self.response_format)
+        if wt not in self.response_formats:
+            raise ValueError("wt must be one of %s" % list(self.response_formats))
+        if wt != 'xml':
+            params['wt'] = wt
+        if wt == 'json':
+            # Named lists as JSON objects, rather than flat arrays
+            # of alternating names and values.
+            params['json.nl'] = 'map'
+        return wt
 
     def mlt_query(self, fields=None, content=None, content_charset=None, url=None, query_fields=None,
                   **kwargs):
@@ -227,6 +682,227 @@ class SolrInterface(object):
         return q
 
 
+class AsyncSolrInterface(object):
+    """A non-blocking counterpart to SolrInterface.
+
+    Every request is handed to a thread pool, and a
+    concurrent.futures.Future for its result is returned immediately,
+    so that the calling thread (typically an event loop) never blocks
+    on Solr. Queries are built exactly as with SolrInterface, and run
+    with execute().
+    """
+    def __init__(self, url=None, max_workers=10, interface=None, **kwargs):
+        if futures is None:
+            raise EnvironmentError("concurrent.futures not available, cannot create AsyncSolrInterface")
+        if interface is None:
+            # One pooled connection per worker, so that requests never
+            # queue for a connection behind one another.
+            kwargs.setdefault('pool_size', max_workers)
+            interface = SolrInterface(url, **kwargs)
+        else:
+            interface.conn.ensure_pool(max_workers)
+        self.interface = interface
+        self.schema = interface.schema
+        self.executor = futures.ThreadPoolExecutor(max_workers)
+
+    def search(self, **kwargs):
+        return self.executor.submit(self.interface.search, **kwargs)
+
+    def mlt_search(self, content=None, **kwargs):
+        return self.executor.submit(self.interface.mlt_search, content=content, **kwargs)
+
+    def execute(self, search, constructor=dict, deadline=None):
+        return self.executor.submit(search.execute, constructor, deadline)
+
+    def add(self, docs, **kwargs):
+        return self.executor.submit(self.interface.add, docs, **kwargs)
+
+    def delete(self, docs=None, queries=None, **kwargs):
+        return self.executor.submit(self.interface.delete, docs, queries, **kwargs)
+
+    def delete_all(self):
+        return self.executor.submit(self.interface.delete_all)
+
+    def commit(self, *args, **kwargs):
+        return self.executor.submit(self.interface.commit, *args, **kwargs)
+
+    def optimize(self, *args, **kwargs):
+        return self.executor.submit(self.interface.optimize, *args, **kwargs)
+
+    def rollback(self):
+        return self.executor.submit(self.interface.rollback)
+
+    def query(self, *args, **kwargs):
+        return self.interface.query(*args, **kwargs)
+
+    def mlt_query(self, *args, **kwargs):
+        return self.interface.mlt_query(*args, **kwargs)
+
+    def Q(self, *args, **kwargs):
+        return self.interface.Q(*args, **kwargs)
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait)
+
+
+class ShardedSolrInterface(object):
+    """Spreads documents across several Solr cores (shards), each
+    document living on the shard picked by hashing its uniqueKey.
+
+    Updates are grouped by shard, and the shards are updated in
+    parallel; deletions by id go only to the shard owning each id, while
+    deletions by query, commits and so on go to every shard. Queries are
+    sent to the first shard, asking it to run a distributed search
+    across all of them (with Solr's shards parameter). Every shard must
+    have the same schema; it is only fetched from the first.
+
+    Each entry in urls may itself be a list of replicas of that shard.
+    Any other keyword arguments are passed on to each shard's
+    SolrInterface, except that the shards share a single query cache,
+    so that an update to any shard invalidates the cached results of
+    the distributed queries.
+    """
+    def __init__(self, urls, schemadoc=None, **kwargs):
+        if futures is None:
+            raise EnvironmentError("concurrent.futures not available, cannot create ShardedSolrInterface")
+        if not urls:
+            raise ValueError("At least one shard is needed")
+        if kwargs.get('cache_size') and kwargs.get('cache') is None:
+            kwargs['cache'] = QueryCache(kwargs['cache_size'], kwargs.get('cache_ttl'))
+        first = SolrInterface(urls[0], schemadoc=schemadoc, **kwargs)
+        self.shards = [first] + [SolrInterface(url, schemadoc=first.schema, **kwargs)
+                                 for url in urls[1:]]
+        self.schema = first.schema
+        if not self.schema.unique_key:
+            raise SolrError("This schema has no unique key - documents can't be sharded")
+        self.readable = first.readable
+        self.writeable = first.writeable
+        # Solr wants shards as host:port/path, without the scheme.
+        self.shards_param = ",".join(
+            "".join(urlparse.urlsplit(shard.conn.url)[1:3]).rstrip("/")
+            for shard in self.shards)
+
+    def shard_for(self, doc):
+        """The interface for the shard owning doc (a document, or the
+        value of its uniqueKey)."""
+        doc_id = self.schema.doc_id_from_doc(doc).to_solr()
+        if isinstance(doc_id, unicode):
+            doc_id = doc_id.encode('utf-8')
+        return self.shards[(zlib.crc32(doc_id) & 0xffffffff) % len(self.shards)]
+
+    def group_by_shard(self, docs):
+        if hasattr(docs, "items") or not hasattr(docs, "__iter__"):
+            docs = [docs]
+        groups = {}
+        for doc in docs:
+            groups.setdefault(self.shard_for(doc), []).append(doc)
+        return groups
+
+    def in_parallel(self, calls):
+        """Run each (shard, fn) pair, all at once. If any fail, a
+        SolrUpdateError listing (shard number, exception) pairs is raised
+        once they have all finished."""
+        if not calls:
+            return
+        executor = futures.ThreadPoolExecutor(len(calls))
+        try:
+            in_flight = dict((executor.submit(fn), self.shards.index(shard))
+                             for shard, fn in calls)
+            done, _ = futures.wait(in_flight)
+        finally:
+            executor.shutdown()
+        errors = [(in_flight[f], f.exception()) for f in done
+                  if f.exception() is not None]
+        if errors:
+            raise SolrUpdateError(sorted(errors))
+
+    def add(self, docs, chunk=100, commit=None, waitFlush=None, waitSearcher=None, **kwargs):
+        """Add docs, routing them to their shards chunk documents at a
+        time, so that only one chunk is held in memory at once. As with
+        concurrent adds, commit=True results in a single commit of every
+        shard once all the chunks have been added."""
+        if hasattr(docs, "items") or not hasattr(docs, "__iter__"):
+            docs = [docs]
+        chunk_commit = False if commit is False else None
+        for doc_chunk in grouper(docs, chunk):
+            self.in_parallel([
+                (shard, lambda shard=shard, docs=shard_docs:
+                     shard.add(docs, chunk=chunk, commit=chunk_commit, **kwargs))
+                for shard, shard_docs in self.group_by_shard(doc_chunk).items()])
+        if commit:
+            self.commit(waitFlush=waitFlush, waitSearcher=waitSearcher)
+
+    def delete(self, docs=None, queries=None, **kwargs):
+        if not docs and not queries:
+            raise SolrError("No docs or query specified for deletion")
+        # One request per shard, with its ids and any queries, since a
+        # shard's connection can only make one request at a time.
+        groups = self.group_by_shard(docs) if docs else {}
+        targets = self.shards if queries else groups.keys()
+        self.in_parallel([
+            (shard, lambda shard=shard, docs=groups.get(shard):
+                 shard.delete(docs=docs, queries=queries or None, **kwargs))
+            for shard in targets])
+
+    def delete_all(self):
+        self.in_parallel([(shard, shard.delete_all) for shard in self.shards])
+
+    def commit(self, *args, **kwargs):
+        self.in_parallel([(shard, lambda shard=shard: shard.commit(*args, **kwargs))
+                          for shard in self.shards])
+
+    def optimize(self, *args, **kwargs):
+        self.in_parallel([(shard, lambda shard=shard: shard.optimize(*args, **kwargs))
+                          for shard in self.shards])
+
+    def rollback(self):
+        self.in_parallel([(shard, shard.rollback) for shard in self.shards])
+
+    @property
+    def conn(self):
+        """The connection queries go through: the first shard's."""
+        return self.shards[0].conn
+
+    def new_trace(self, kind):
+        return self.shards[0].new_trace(kind)
+
+    def submit(self, fn, *args, **kwargs):
+        return self.shards[0].submit(fn, *args, **kwargs)
+
+    def search(self, **kwargs):
+        kwargs.setdefault('shards', self.shards_param)
+        return self.shards[0].search(**kwargs)
+
+    def stream_search(self, constructor=dict, **kwargs):
+        kwargs.setdefault('shards', self.shards_param)
+        return self.shards[0].stream_search(constructor=constructor, **kwargs)
+
+    def mlt_search(self, content=None, **kwargs):
+        kwargs.setdefault('shards', self.shards_param)
+        return self.shards[0].mlt_search(content=content, **kwargs)
+
+    def query(self, *args, **kwargs):
+        if not self.readable:
+            raise TypeError("This Solr instance is only for writing")
+        q = SolrSearch(self)
+        if len(args) + len(kwargs) > 0:
+            return q.query(*args, **kwargs)
+        else:
+            return q
+
+    def mlt_query(self, fields=None, content=None, content_charset=None, url=None, query_fields=None,
+                  **kwargs):
+        if not self.readable:
+            raise TypeError("This Solr instance is only for writing")
+        q = MltSolrSearch(self, content=content, content_charset=content_charset, url=url)
+        return q.mlt(fields=fields, query_fields=query_fields, **kwargs)
+
+    def Q(self, *args, **kwargs):
+        q = LuceneQuery(self.schema)
+        q.add(args, kwargs)
+        return q
+
+
 def grouper(iterable, n):
     "grouper('ABCDEFG', 3) --> [['ABC'], ['DEF'], ['G']]"
     i = iter(iterable)
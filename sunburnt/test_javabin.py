@@ -0,0 +1,303 @@
+from __future__ import absolute_import
+
+try:
+    from cStringIO import StringIO
+except ImportError:
+    from StringIO import StringIO
+
+import calendar, datetime, json, struct
+
+from lxml.builder import E
+from lxml.etree import tostring
+
+from . import javabin
+from .schema import SolrSchema, DecodedSolrResponse
+
+from nose.tools import assert_equal
+
+schema_string = \
+"""<schema name="timetric" version="1.1">
+  <types>
+    <fieldType name="string" class="solr.StrField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="text" class="solr.TextField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="boolean" class="solr.BoolField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="int" class="solr.TrieIntField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="long" class="solr.TrieLongField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="float" class="solr.TrieFloatField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="double" class="solr.TrieDoubleField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="date" class="solr.TrieDateField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="binary" class="solr.BinaryField"/>
+  </types>
+  <fields>
+    <field name="int_field" required="true" type="int"/>
+    <field name="string_field" type="string" multiValued="true"/>
+    <field name="text_field" type="text"/>
+    <field name="boolean_field" type="boolean"/>
+    <field name="long_field" type="long"/>
+    <field name="float_field" type="float"/>
+    <field name="double_field" type="double"/>
+    <field name="date_field" type="date"/>
+    <field name="binary_field" type="binary"/>
+    <dynamicField name="*_s" type="string"/>
+  </fields>
+  <defaultSearchField>text_field</defaultSearchField>
+  <uniqueKey>int_field</uniqueKey>
+</schema>"""
+
+schema = SolrSchema(StringIO(schema_string))
+
+
+# A minimal javabin encoder, enough to write the responses below.
+
+class NamedList(list):
+    pass
+
+class Doc(list):
+    pass
+
+class DocList(object):
+    def __init__(self, num_found, start, docs):
+        self.num_found, self.start, self.docs = num_found, start, docs
+
+class Float(float):
+    pass
+
+class Long(long):
+    pass
+
+class Binary(str):
+    pass
+
+def write_vint(out, i):
+    while i & ~0x7f:
+        out.append(chr((i & 0x7f) | 0x80))
+        i >>= 7
+    out.append(chr(i))
+
+def write_tag(out, tag, size):
+    if size < 0x1f:
+        out.append(chr(tag | size))
+    else:
+        out.append(chr(tag | 0x1f))
+        write_vint(out, size - 0x1f)
+
+def write_val(out, v, strings):
+    if v is None:
+        out.append(chr(javabin.NULL))
+    elif v is True:
+        out.append(chr(javabin.BOOL_TRUE))
+    elif v is False:
+        out.append(chr(javabin.BOOL_FALSE))
+    elif isinstance(v, Long):
+        out.append(chr(javabin.LONG) + struct.pack(">q", v))
+    elif isinstance(v, int):
+        if 0 <= v < 0x0f:
+            out.append(chr(javabin.SINT | v))
+        else:
+            out.append(chr(javabin.INT) + struct.pack(">i", v))
+    elif isinstance(v, Float):
+        out.append(chr(javabin.FLOAT) + struct.pack(">f", v))
+    elif isinstance(v, float):
+        out.append(chr(javabin.DOUBLE) + struct.pack(">d", v))
+    elif isinstance(v, datetime.datetime):
+        ms = calendar.timegm(v.timetuple()) * 1000 + v.microsecond // 1000
+        out.append(chr(javabin.DATE) + struct.pack(">q", ms))
+    elif isinstance(v, Binary):
+        out.append(chr(javabin.BYTEARR))
+        write_vint(out, len(v))
+        out.append(v)
+    elif isinstance(v, basestring):
+        s = unicode(v).encode('utf-8')
+        write_tag(out, javabin.STR, len(s))
+        out.append(s)
+    elif isinstance(v, Doc):
+        out.append(chr(javabin.SOLRDOC))
+        write_named_list(out, javabin.ORDERED_MAP, v, strings)
+    elif isinstance(v, DocList):
+        out.append(chr(javabin.SOLRDOCLST))
+        write_val(out, [Long(v.num_found), Long(v.start), None], strings)
+        write_val(out, v.docs, strings)
+    elif isinstance(v, NamedList):
+        write_named_list(out, javabin.NAMED_LST, v, strings)
+    elif isinstance(v, list):
+        write_tag(out, javabin.ARR, len(v))
+        for item in v:
+            write_val(out, item, strings)
+    else:
+        raise TypeError(v)
+
+def write_named_list(out, tag, pairs, strings):
+    write_tag(out, tag, len(pairs))
+    for name, value in pairs:
+        # Names are written as extern strings, as Solr does.
+        if name in strings:
+            write_tag(out, javabin.EXTERN_STRING, strings.index(name) + 1)
+        else:
+            strings.append(name)
+            write_tag(out, javabin.EXTERN_STRING, 0)
+            write_val(out, name, strings)
+        write_val(out, value, strings)
+
+def dumps(v):
+    out = [chr(javabin.VERSION)]
+    write_val(out, v, [])
+    return "".join(out)
+
+
+# The same responses, in both XML and javabin.
+
+docs = [
+    [("int_field", 1),
+     ("string_field", [u"one", u"un"]),
+     ("text_field", u"The first document \u2013 with unicode"),
+     ("boolean_field", True),
+     ("long_field", Long(2**40)),
+     ("float_field", Float(0.1)),
+     ("double_field", 1.0/3),
+     ("date_field", datetime.datetime(2009, 7, 23, 3, 24, 34)),
+     ("binary_field", Binary("\x00\x01binary")),
+     ("colour_s", u"red"),
+     ("score", Float(1.5))],
+    [("int_field", 200),
+     ("string_field", [u"two"]),
+     ("boolean_field", False),
+     ("score", Float(0.25))],
+    ]
+
+def xml_value(name, v):
+    attrs = {'name':name} if name is not None else {}
+    if isinstance(v, bool):
+        return E.bool(attrs, "true" if v else "false")
+    elif isinstance(v, Long):
+        return E.long(attrs, str(v))
+    elif isinstance(v, int):
+        return E.int(attrs, str(v))
+    elif isinstance(v, Float):
+        return E.float(attrs, repr(float(v)) if float(v) != 0.1 else "0.1")
+    elif isinstance(v, float):
+        return E.double(attrs, repr(v))
+    elif isinstance(v, datetime.datetime):
+        return E.date(attrs, v.strftime("%Y-%m-%dT%H:%M:%S.") + "%03dZ" % (v.microsecond // 1000))
+    elif isinstance(v, Binary):
+        return E.str(attrs, v.encode('base64'))
+    elif isinstance(v, basestring):
+        return E.str(attrs, v)
+    elif isinstance(v, NamedList):
+        return E.lst(attrs, *[xml_value(k, x) for k, x in v])
+    elif isinstance(v, list):
+        return E.arr(attrs, *[xml_value(None, x) for x in v])
+
+def xml_doclist(name, doclist):
+    return E.result({'name':name, 'numFound':str(doclist.num_found), 'start':str(doclist.start)},
+                    *[E.doc(*[xml_value(k, v) for k, v in doc]) for doc in doclist.docs])
+
+def xml_response(details):
+    nodes = []
+    for name, value in details:
+        if isinstance(value, DocList):
+            nodes.append(xml_doclist(name, value))
+        elif name == 'grouped':
+            field, group = value[0]
+            nodes.append(E.lst({'name':'grouped'}, E.lst({'name':field},
+                xml_value('matches', group[0][1]), xml_value('ngroups', group[1][1]),
+                E.arr({'name':'groups'}, *[
+                    E.lst(xml_value('groupValue', g[0][1]), xml_doclist('doclist', g[1][1]))
+                    for g in group[2][1]]))))
+        else:
+            nodes.append(xml_value(name, value))
+    return tostring(E.response(*nodes), encoding='utf-8')
+
+def javabin_response(details):
+    return dumps(NamedList((name, Doc(v) if isinstance(v, Doc) else v) for name, v in details))
+
+def json_value(v):
+    # Named lists are written as objects, as with json.nl=map.
+    if isinstance(v, (NamedList, Doc)):
+        return "{%s}" % ",".join("%s:%s" % (json.dumps(k), json_value(x)) for k, x in v)
+    elif isinstance(v, DocList):
+        return '{"numFound":%s,"start":%s,"docs":[%s]}' % (
+            v.num_found, v.start, ",".join(json_value(Doc(d)) for d in v.docs))
+    elif isinstance(v, list):
+        return "[%s]" % ",".join(json_value(x) for x in v)
+    elif isinstance(v, datetime.datetime):
+        return json.dumps(v.strftime("%Y-%m-%dT%H:%M:%SZ"))
+    elif isinstance(v, Binary):
+        return json.dumps(v.encode('base64'))
+    elif isinstance(v, Float):
+        return repr(float(v)) if float(v) != 0.1 else "0.1"
+    return json.dumps(v)
+
+def json_response(details):
+    return json_value(NamedList(details))
+
+plain_response = [
+    ("responseHeader", NamedList([("status", 0), ("QTime", 12),
+        ("params", NamedList([("q", u"*:*"), ("facet.field", [u"string_field", u"colour_s"])]))])),
+    ("response", DocList(2, 0, [Doc(doc) for doc in docs])),
+    ("facet_counts", NamedList([
+        ("facet_queries", NamedList()),
+        ("facet_fields", NamedList([
+            ("string_field", NamedList([(u"one", 1), (u"two", 1), (u"un", 1)])),
+            ("colour_s", NamedList([(u"red", 1)]))])),
+        ("facet_dates", NamedList())])),
+    ("highlighting", NamedList([
+        ("1", NamedList([("text_field", [u"The <em>first</em> document"])])),
+        ("200", NamedList())])),
+    ("nextCursorMark", u"AoEjR0JQ"),
+    ]
+
+grouped_response = [
+    ("responseHeader", NamedList([("status", 0), ("QTime", 3),
+        ("params", NamedList([("group", u"true"), ("group.field", u"boolean_field")]))])),
+    ("grouped", NamedList([("boolean_field", NamedList([
+        ("matches", 2), ("ngroups", 2),
+        ("groups", [NamedList([("groupValue", u"true"), ("doclist", DocList(1, 0, [Doc(docs[0])]))]),
+                    NamedList([("groupValue", u"false"), ("doclist", DocList(1, 0, [Doc(docs[1])]))])])]))])),
+    ]
+
+
+def check_parity(details, wt, encode):
+    xml = schema.parse_response(xml_response(details))
+    jb = schema.parse_response(encode(details), wt)
+    assert isinstance(jb, DecodedSolrResponse)
+    assert_equal(jb.status, xml.status)
+    assert_equal(jb.QTime, xml.QTime)
+    assert_equal(dict(jb.params), dict(xml.params))
+    assert_equal(jb.result.numFound, xml.result.numFound)
+    assert_equal(jb.result.docs, xml.result.docs)
+    assert_equal(jb.facet_counts.facet_fields, xml.facet_counts.facet_fields)
+    assert_equal(jb.highlighting, xml.highlighting)
+    assert_equal(jb.next_cursor_mark, xml.next_cursor_mark)
+    if hasattr(xml.result, 'groups'):
+        assert_equal(jb.result.matches, xml.result.matches)
+        assert_equal(sorted(jb.result.groups), sorted(xml.result.groups))
+        for k in xml.result.groups:
+            assert_equal(jb.result.groups[k].docs, xml.result.groups[k].docs)
+    else:
+        assert_equal(jb.result.start, xml.result.start)
+
+def test_decoded_response_parity():
+    for wt, encode in (('javabin', javabin_response), ('json', json_response)):
+        for details in (plain_response, grouped_response):
+            yield check_parity, details, wt, encode
+
+
+def test_javabin_values():
+    for v in (None, True, False, 0, 14, 15, -1, 2**31-1, Long(-2**63),
+              1.5, u"", u"short", u"x"*1000, [1, [2, u"three"]],
+              NamedList([("a", 1), ("b", NamedList([("a", 2)]))])):
+        assert_equal(javabin.loads(dumps(v)), v)
+
+def test_javabin_small_ints():
+    # SINT packs the low four bits into the tag, and the rest into a vint.
+    assert_equal(javabin.loads(chr(2) + chr(javabin.SINT | 0x10 | 0x5) + chr(0x81) + chr(0x01)),
+                 (0x81 & 0x7f | 1 << 7) << 4 | 0x5)
+
+def test_javabin_truncated():
+    data = dumps(NamedList([("a", u"a long string value")]))
+    try:
+        javabin.loads(data[:-5])
+    except javabin.JavabinError:
+        pass
+    else:
+        assert False
@@ -2,12 +2,13 @@ from __future__ import absolute_import
 
 import cStringIO as StringIO
 import datetime
+import json
 import uuid
 
 import mx.DateTime
 import pytz
 
-from .schema import solr_date, SolrSchema, SolrError, SolrUpdate, SolrDelete
+from .schema import solr_date, SolrSchema, SolrError, SolrUpdate, SolrUpdateStream, SolrDelete, SolrJSONUpdate, SolrJSONDelete, SolrCSVUpdate
 from .search import LuceneQuery
 
 debug = False
@@ -186,6 +187,62 @@ def test_broken_schemata():
         yield check_broken_schemata, k, v
 
 
+dynamic_schema = \
+"""
+<schema name="timetric" version="1.1">
+  <types>
+    <fieldType name="sint" class="solr.SortableIntField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="string" class="solr.StrField" sortMissingLast="true" omitNorms="true"/>
+    <fieldType name="text" class="solr.TextField" sortMissingLast="true" omitNorms="true"/>
+  </types>
+  <fields>
+    <field name="int_field" required="true" type="sint"/>
+    <dynamicField name="*_s" type="string"/>
+    <dynamicField name="*_text_s" type="text"/>
+    <dynamicField name="attr_*" type="string"/>
+    <dynamicField name="*_i" type="sint"/>
+    <dynamicField name="nu_*" type="sint"/>
+    <dynamicField name="*_in" type="sint"/>
+    <dynamicField name="*" type="text"/>
+  </fields>
+  <uniqueKey>int_field</uniqueKey>
+ </schema>
+"""
+
+dynamic_field_matches = (
+    ("title_s", "*_s"),
+    ("title_text_s", "*_text_s"), # longest pattern wins
+    ("attr_colour", "attr_*"),
+    ("attr_colour_text_s", "*_text_s"),
+    ("attr_count_i", "attr_*"),
+    ("nu_count_in", "nu_*"), # same length; first in the schema wins
+    ("count_in", "*_in"),
+    ("nu_count_s", "nu_*"),
+    ("count_i", "*_i"),
+    ("_i", "*_i"),
+    ("int_field", "int_field"),
+    ("anything", "*"),
+    ("", "*"),
+    )
+
+def check_dynamic_field_match(schema, name, pattern):
+    assert schema.match_field(name).name == pattern
+    # and again, from the memo
+    assert schema.match_field(name).name == pattern
+
+def test_dynamic_field_matching():
+    schema = SolrSchema(StringIO.StringIO(dynamic_schema))
+    for name, pattern in dynamic_field_matches:
+        yield check_dynamic_field_match, schema, name, pattern
+
+def test_dynamic_field_memo_is_bounded():
+    schema = SolrSchema(StringIO.StringIO(good_schema))
+    schema.dynamic_field_memo_size = 10
+    for i in range(25):
+        assert schema.match_field("unknown_%s" % i) is None
+    assert len(schema.dynamic_field_memo) <= 10
+
+
 class D(object):
     def __init__(self, int_field, text_field=None, my_arse=None):
         self.int_field = int_field
@@ -282,6 +339,59 @@ def test_update_serialization():
     for obj, xml_string in update_docs:
         yield check_update_serialization, s, obj, xml_string
 
+def check_update_stream_serialization(s, obj, xml_string):
+    pieces = list(SolrUpdateStream(s, obj))
+    assert "".join(pieces) == xml_string
+    # one piece for each document, plus the opening and closing tags.
+    assert len(pieces) == 2 + xml_string.count("<doc>")
+
+def test_update_stream_serialization():
+    s = SolrSchema(StringIO.StringIO(good_schema))
+    for obj, xml_string in update_docs:
+        yield check_update_stream_serialization, s, obj, xml_string
+
+json_update_docs = [
+    ({"int_field":1, "text_field":"a"},
+     [{"int_field":"1", "text_field":"a"}]),
+    ({"int_field":1, "text_field":["a", "b"]},
+     [{"int_field":"1", "text_field":["a", "b"]}]),
+    ([D(1, "a"), {"int_field":2, "text_field":"b"}],
+     [{"int_field":"1", "text_field":"a"}, {"int_field":"2", "text_field":"b"}]),
+    ([], []),
+    ]
+
+def check_json_update_serialization(s, obj, docs):
+    assert json.loads(str(SolrJSONUpdate(s, obj))) == docs
+
+def test_json_update_serialization():
+    s = SolrSchema(StringIO.StringIO(good_schema))
+    for obj, docs in json_update_docs:
+        yield check_json_update_serialization, s, obj, docs
+
+def test_csv_update_serialization():
+    s = SolrSchema(StringIO.StringIO(good_schema))
+    rows = [(1, "a"), (2, 'b, "c"'), (3, None)]
+    update = SolrCSVUpdate(s, rows, ["int_field", "text_field"])
+    assert list(update) == ['1,a\n', '2,"b, ""c"""\n', '3,\n']
+    assert update.params() == {"header":"false", "fieldnames":"int_field,text_field",
+                               "f.text_field.split":"true", "f.text_field.separator":"|"}
+    try:
+        list(SolrCSVUpdate(s, [(1, "a|b")], ["int_field", "text_field"]))
+    except SolrError:
+        pass
+    else:
+        assert False
+
+def test_csv_update_bad_fields():
+    s = SolrSchema(StringIO.StringIO(good_schema))
+    for fields in (["int_field", "text_field", "my_arse"], ["int_field"]):
+        try:
+            SolrCSVUpdate(s, [], fields)
+        except SolrError:
+            pass
+        else:
+            assert False
+
 bad_updates = [
     # Dictionary containing bad field name
     {"int_field":1, "text_field":"a", "my_arse":True},
@@ -371,6 +481,11 @@ def test_delete_queries():
     for queries, xml_string in delete_queries:
         yield check_delete_queries, s, queries, xml_string
 
+def test_json_delete():
+    s = SolrSchema(StringIO.StringIO(good_schema))
+    p = str(SolrJSONDelete(s, docs=["0", D(1, "a")], queries=[s.Q("search")]))
+    assert p == '{"delete":{"id": "0"},"delete":{"id": "1"},"delete":{"query": "search"}}'
+
 
 new_field_types_schema = \
 """
@@ -5,13 +5,23 @@ try:
 except ImportError:
     from StringIO import StringIO
 
-import cgi, datetime, urlparse
+import cgi, datetime, httplib, json, socket, threading, time, urlparse
+
+import httplib2
 
 from lxml.builder import E
 from lxml.etree import tostring
 import mx.DateTime
 
-from .sunburnt import SolrInterface
+from .schema import SolrError
+from .sunburnt import AsyncSolrInterface, ShardedSolrInterface, SolrInterface, SolrUpdateError
+from .cache import QueryCache, SingleFlight
+from .cluster import LoadBalancedConnection, ReplicaState
+from .instrumentation import Instrumentation
+from .transport import BodyReplayError, ChunkedBody, CircuitBreaker, CircuitOpenError, \
+    ConnectionPool, DeadlineExceeded, RetryPolicy, gunzip_string, gzip_string, send_once
+from .test_javabin import Doc, DocList, NamedList, dumps, json_value, \
+    plain_response, schema_string as typed_schema_string, xml_response
 
 from nose.tools import assert_equal
 
@@ -281,3 +291,1311 @@ def check_mlt_query(i, o, E):
 def test_mlt_queries():
     for i, o, E in mlt_query_tests:
         yield check_mlt_query, i, o, E
+
+
+class CountingMockConnection(PaginationMockConnection):
+    instances = []
+    def __init__(self):
+        super(CountingMockConnection, self).__init__()
+        self.instances.append(self)
+
+def test_connection_pool_reuses_connections():
+    CountingMockConnection.instances = []
+    pool = ConnectionPool(2, factory=CountingMockConnection)
+    si = SolrInterface("http://test.example.com/", http_connection=pool)
+    for i in range(5):
+        si.query("*").execute()
+    assert_equal(len(CountingMockConnection.instances), 1)
+    assert_equal(pool.stats.checkouts, 6)
+
+def test_connection_pool_is_bounded():
+    CountingMockConnection.instances = []
+    pool = ConnectionPool(1, timeout=0.01, factory=CountingMockConnection)
+    http = pool.checkout()
+    try:
+        pool.checkout()
+    except SolrError:
+        pass
+    else:
+        assert False
+    assert_equal(pool.stats.timeouts, 1)
+    pool.checkin(http)
+    assert pool.checkout() is http
+
+def test_connection_pool_discards_broken_connections():
+    class BrokenConnection(object):
+        def request(self, *args, **kwargs):
+            raise socket.error("connection reset")
+    pool = ConnectionPool(1, factory=BrokenConnection)
+    try:
+        pool.request("http://test.example.com/select/")
+    except socket.error:
+        pass
+    else:
+        assert False
+    assert_equal(pool.created, 0)
+    assert_equal(pool.idle, [])
+
+def test_connection_pool_wakes_waiters_on_discard():
+    started = threading.Event()
+    class SlowBrokenConnection(object):
+        def request(self, *args, **kwargs):
+            started.set()
+            time.sleep(0.05)
+            raise socket.error("connection reset")
+    pool = ConnectionPool(1, factory=SlowBrokenConnection)
+    errors = []
+    def request():
+        try:
+            pool.request("http://test.example.com/select/")
+        except socket.error, e:
+            errors.append(e)
+    first = threading.Thread(target=request)
+    first.start()
+    started.wait()
+    # This one waits for the pool, until the first connection is discarded.
+    second = threading.Thread(target=request)
+    second.daemon = True
+    second.start()
+    first.join()
+    second.join(2)
+    assert not second.is_alive()
+    assert_equal(len(errors), 2)
+    assert_equal(pool.created, 0)
+
+def test_async_interface():
+    si = SolrInterface("http://test.example.com/",
+                       http_connection=shared_pool(PaginationMockConnection(), 4))
+    asi = AsyncSolrInterface(interface=si, max_workers=4)
+    try:
+        fs = [asi.execute(asi.query("*").paginate(start=i, rows=1))
+              for i in range(5)]
+        assert_equal([f.result()[0]['int_field'] for f in fs], range(5))
+        response = asi.search(q="*:*", start=3, rows=2).result()
+        assert_equal([d['int_field'] for d in response], [3, 4])
+    finally:
+        asi.shutdown()
+
+
+class UpdateMockConnection(MockConnection):
+    def __init__(self, fail_on=None):
+        super(UpdateMockConnection, self).__init__()
+        self.updates = []
+        self.fail_on = fail_on
+
+    def _handle_request(self, u, params, method, body, headers):
+        if method == 'POST' and u.path.rstrip('/').rsplit('/', 1)[-1] in ('update', 'json', 'csv'):
+            self.updates.append((params, body))
+            if self.fail_on and self.fail_on in body:
+                return self.MockStatus(500), "failed"
+            return self.MockStatus(200), ""
+
+update_docs = [{"int_field":i, "string_field":"s%s" % i, "text_field":"t%s" % i}
+               for i in range(25)]
+
+def shared_pool(http, size):
+    """A pool which hands out the same mock connection to every thread."""
+    return ConnectionPool(size, factory=lambda: http)
+
+def test_concurrent_add():
+    http = UpdateMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=shared_pool(http, 3))
+    si.add(update_docs, chunk=10, concurrency=3, commit=True, waitFlush=False)
+    bodies = [b for p, b in http.updates]
+    assert_equal(len(bodies), 4)
+    assert_equal(sum(b.count('<doc>') for b in bodies), 25)
+    # one commit only, after all the chunks.
+    assert_equal([p.get('commit') for p, b in http.updates[:3]], [None, None, None])
+    assert_equal(bodies[-1], '<commit/>')
+    assert_equal(http.updates[-1][0].get('waitFlush'), ['false'])
+
+def test_concurrent_add_reports_failed_chunks():
+    http = UpdateMockConnection(fail_on='<field name="int_field">12</field>')
+    si = SolrInterface("http://test.example.com/", http_connection=shared_pool(http, 2))
+    try:
+        si.add(update_docs, chunk=10, concurrency=2, commit=True)
+    except SolrUpdateError, e:
+        assert_equal([i for i, _ in e.errors], [1])
+    else:
+        assert False
+    assert '<commit/>' not in [b for p, b in http.updates]
+
+def test_concurrent_add_needs_pool():
+    si = SolrInterface("http://test.example.com/", http_connection=UpdateMockConnection())
+    try:
+        si.add(update_docs, chunk=10, concurrency=2)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+
+def read_chunked_body(body):
+    data = []
+    while True:
+        chunk = body.read()
+        size, _, rest = chunk.partition("\r\n")
+        if int(size, 16) == 0:
+            return "".join(data)
+        data.append(rest[:-2])
+
+class StreamingUpdateMockConnection(UpdateMockConnection):
+    def _handle_request(self, u, params, method, body, headers):
+        if isinstance(body, ChunkedBody):
+            assert_equal(headers['Transfer-Encoding'], 'chunked')
+            body = read_chunked_body(body)
+        return super(StreamingUpdateMockConnection, self)._handle_request(
+            u, params, method, body, headers)
+
+def test_streaming_add():
+    http = StreamingUpdateMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    si.add(update_docs, chunk=10, stream=True)
+    assert_equal([b.count('<doc>') for p, b in http.updates], [10, 10, 5])
+    http.updates = []
+    si.add(iter(update_docs), chunk=None, stream=True)
+    assert_equal(len(http.updates), 1)
+    assert_equal(http.updates[0][1], str(si.schema.make_update(update_docs)))
+
+def test_streaming_add_reraises_serialization_errors():
+    http = StreamingUpdateMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    try:
+        si.add(update_docs + [{"int_field":100}], chunk=None, stream=True)
+    except SolrError, e:
+        assert 'required fields' in e.args[0]
+    else:
+        assert False
+    # The mock only records complete bodies; the terminator was never sent.
+    assert_equal(http.updates, [])
+
+def listening_socket():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(1)
+    return listener, "http://127.0.0.1:%s/update" % listener.getsockname()[1]
+
+def test_send_once_aborts_on_serialization_errors():
+    listener, url = listening_socket()
+    received = []
+    def serve():
+        conn, _ = listener.accept()
+        while True:
+            data = conn.recv(4096)
+            if not data:
+                break
+            received.append(data)
+        conn.close()
+    server = threading.Thread(target=serve)
+    server.start()
+    def body():
+        yield "<add>"
+        raise ValueError("bad document")
+    try:
+        send_once(httplib2.Http(), url, "POST", body=ChunkedBody(body()),
+                  headers=ChunkedBody.headers)
+    except ValueError:
+        pass
+    else:
+        assert False
+    server.join(5)
+    listener.close()
+    received = "".join(received)
+    assert "5\r\n<add>\r\n" in received
+    assert not received.endswith("0\r\n\r\n")
+
+def test_send_once_never_resends():
+    listener, url = listening_socket()
+    key = "http:" + urlparse.urlparse(url).netloc
+    http = httplib2.Http()
+    http.connections[key] = stale = httplib2.HTTPConnectionWithTimeout("127.0.0.1", 1)
+    body = ChunkedBody(["<add/>"])
+    body.sent = True
+    try:
+        send_once(http, url, "POST", body=body)
+    except BodyReplayError:
+        pass
+    else:
+        assert False
+    listener.close()
+    # The kept-alive connection was not used.
+    assert http.connections.get(key) is not stale
+
+def test_json_update_format():
+    http = UpdateMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http, update_format='json')
+    si.add(update_docs[:3])
+    si.delete(queries=si.Q("hello"))
+    assert_equal(http.tracking_dict['url'], "http://test.example.com/update/json")
+    assert_equal(http.tracking_dict['headers']['Content-Type'], "application/json; charset=utf-8")
+    assert_equal(len(json.loads(http.updates[0][1])), 3)
+    assert_equal(http.updates[1][1], '{"delete":{"query": "hello"}}')
+
+def test_csv_add():
+    http = StreamingUpdateMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    rows = ((i, ["s%s" % i, "t%s" % i], "text %s" % i) for i in range(3))
+    si.add_csv(rows, ["int_field", "string_field", "text_field"], commit=True)
+    params, body = http.updates[0]
+    assert http.tracking_dict['url'].startswith("http://test.example.com/update/csv?")
+    assert_equal(http.tracking_dict['headers']['Content-Type'], "text/csv; charset=utf-8")
+    assert_equal(params['fieldnames'], ["int_field,string_field,text_field"])
+    assert_equal(params['f.string_field.split'], ["true"])
+    assert_equal(params['f.string_field.separator'], ["|"])
+    assert_equal(params['commit'], ["true"])
+    assert_equal(body, "0,s0|t0,text 0\n1,s1|t1,text 1\n2,s2|t2,text 2\n")
+
+def test_csv_add_bad_row():
+    http = StreamingUpdateMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    rows = [(0, "s0", "text 0"), (1, "s1", "text 1"), (2, "s2", "text 2"),
+            ("three", "s3", "text 3"), (4, "s4", "text 4")]
+    try:
+        si.add_csv(rows, ["int_field", "string_field", "text_field"], commit=True)
+    except SolrError, e:
+        assert 'invalid value' in e.args[0]
+    else:
+        assert False
+    # The rows before the bad one were never sent as a complete update.
+    assert_equal(http.updates, [])
+
+class DecodedMockConnection(PaginationMockConnection):
+    def _handle_request(self, uri_obj, params, method, body, headers):
+        status, xml = PaginationMockConnection._handle_request(self, uri_obj, params, method, body, headers)
+        if params.get("wt") not in (["javabin"], ["json"]):
+            return status, xml
+        start = int(params.get("start", [0])[0])
+        rows = int(params.get("rows", [10])[0])
+        docs = [Doc([("int_field", d['int_field']), ("string_field", d['string_field'])])
+                for d in MockResponse.mock_docs[start:start+rows]]
+        response = NamedList([
+            ("responseHeader", NamedList([("status", 0), ("QTime", 0)])),
+            ("response", DocList(len(MockResponse.mock_docs), start, docs))])
+        if params["wt"] == ["json"]:
+            return status, json_value(response)
+        return status, dumps(response)
+
+def test_javabin_response_format():
+    http = DecodedMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http, response_format='javabin')
+    response = si.query("*").paginate(start=2, rows=3).execute()
+    assert_equal(http.tracking_dict['params']['wt'], ["javabin"])
+    assert_equal([d['int_field'] for d in response], [2, 3, 4])
+    # The format can still be chosen per query.
+    response = si.search(q="*:*", start=2, rows=3, wt="xml")
+    assert_equal(http.tracking_dict['params']['wt'], ["xml"])
+    assert_equal([d['int_field'] for d in response], [2, 3, 4])
+    # XML responses leave wt to Solr's default.
+    SolrInterface("http://test.example.com/", http_connection=http).search(q="*:*")
+    assert 'wt' not in http.tracking_dict['params']
+
+def test_json_response_format():
+    http = DecodedMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    response = si.query("*").paginate(start=2, rows=3).response_format('json').execute()
+    assert_equal(http.tracking_dict['params']['wt'], ["json"])
+    assert_equal(http.tracking_dict['params']['json.nl'], ["map"])
+    assert_equal([d['int_field'] for d in response], [2, 3, 4])
+    assert_equal(response.result.docs[0]['string_field'], u'two')
+    try:
+        si.query("*").response_format('csv').execute()
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_iterate():
+    response = conn.query("*").paginate(start=2, rows=5).iterate()
+    docs = iter(response)
+    assert_equal(docs.next()['int_field'], 2)
+    assert_equal((response.numFound, response.start), (10, 2))
+    assert_equal([d['int_field'] for d in docs], [3, 4, 5, 6])
+    assert_equal(response.status, 0)
+    try:
+        list(response)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_iterate_parity():
+    http = MockConnection()
+    http._handle_request = lambda *args: (http.MockStatus(200), xml_response(plain_response))
+    si = SolrInterface("http://test.example.com/", http_connection=http,
+                       schemadoc=StringIO(typed_schema_string))
+    response = si.search(q="*:*")
+    streamed = si.query("*").iterate()
+    assert_equal(list(streamed), response.result.docs)
+    for attr in ("QTime", "params", "highlighting", "next_cursor_mark"):
+        assert_equal(getattr(streamed, attr), getattr(response, attr))
+    assert_equal(streamed.facet_counts.facet_fields, response.facet_counts.facet_fields)
+
+class CursorMockConnection(MockConnection):
+    def _handle_request(self, uri_obj, params, method, body, headers):
+        self.requests = getattr(self, 'requests', 0) + 1
+        self.sort = params["sort"]
+        cursor_mark = params["cursorMark"][0]
+        start = 0 if cursor_mark == "*" else int(cursor_mark)
+        rows = int(params["rows"][0])
+        docs = MockResponse.mock_docs[start:start+rows]
+        return self.MockStatus(200), tostring(E.response(
+            E.lst({'name':'responseHeader'}, E.int({'name':'status'}, '0'), E.int({'name':'QTime'}, '0')),
+            E.result({'name':'response', 'numFound':str(len(MockResponse.mock_docs)), 'start':'0'},
+                     *[MockResponse.xmlify_doc(d) for d in docs]),
+            E.str({'name':'nextCursorMark'}, str(start + len(docs)))))
+
+def test_cursor():
+    http = CursorMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    assert_equal([d['int_field'] for d in si.query("*").cursor(rows=4)], range(10))
+    # Three full or partial pages, and one to find the cursor has stopped.
+    assert_equal(http.requests, 4)
+    assert_equal(http.sort, ["int_field asc"])
+    list(si.query("*").sort_by("-date_field").cursor(rows=4))
+    assert_equal(http.sort, ["date_field desc, int_field asc"])
+    try:
+        si.query("*").paginate(start=5).cursor()
+    except SolrError:
+        pass
+    else:
+        assert False
+
+class CachingMockConnection(PaginationMockConnection):
+    selects = 0
+    def _handle_request(self, uri_obj, params, method, body, headers):
+        if uri_obj.path.endswith('/update/'):
+            return self.MockStatus(200), ""
+        self.selects += 1
+        return super(CachingMockConnection, self)._handle_request(uri_obj, params, method, body, headers)
+
+def test_query_cache():
+    http = CachingMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http, cache_size=1024*1024)
+    for i in range(3):
+        assert_equal([d['int_field'] for d in si.query("*").paginate(rows=2).execute()], [0, 1])
+    si.query("*").paginate(start=2, rows=2).execute()
+    assert_equal(http.selects, 2)
+    assert_equal((si.cache.stats.hits, si.cache.stats.misses), (2, 2))
+    si.commit()
+    assert_equal(len(si.cache), 0)
+    si.query("*").paginate(rows=2).execute()
+    assert_equal(http.selects, 3)
+
+def test_query_cache_eviction():
+    cache = QueryCache(max_bytes=10)
+    cache.set("a", "12345")
+    cache.set("b", "12345")
+    cache.get("a")
+    cache.set("c", "12345")
+    assert_equal((cache.get("a"), cache.get("b"), cache.get("c")), ("12345", None, "12345"))
+    assert_equal(cache.stats.evictions, 1)
+    cache.set("d", "x" * 11)
+    assert cache.get("d") is None
+
+def test_query_cache_expiry():
+    cache = QueryCache(ttl=0)
+    cache.set("a", "12345")
+    assert cache.get("a") is None
+    assert_equal(cache.stats.expirations, 1)
+
+def test_query_cache_ignores_stale_responses():
+    cache = QueryCache()
+    def fetch():
+        # An update completes while this request is in flight.
+        cache.invalidate()
+        return "stale"
+    assert_equal(cache.fetch("a", fetch), "stale")
+    assert cache.get("a") is None
+
+class SchemaMockConnection(MockConnection):
+    class MockStatus(dict):
+        def __init__(self, status, **headers):
+            super(SchemaMockConnection.MockStatus, self).__init__(headers)
+            self.status = status
+
+    def __init__(self):
+        super(SchemaMockConnection, self).__init__()
+        self.schema_requests = []
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        if urlparse.urlparse(uri).path.endswith('/admin/file/'):
+            etag = (headers or {}).get("If-None-Match")
+            self.schema_requests.append(etag)
+            if etag == '"v1"':
+                return self.MockStatus(304), ""
+            return self.MockStatus(200, etag='"v1"'), schema_string
+        return super(SchemaMockConnection, self).request(uri, method, body, headers)
+
+def test_schema_cache():
+    import shutil, tempfile
+    cache_dir = tempfile.mkdtemp()
+    try:
+        http = SchemaMockConnection()
+        si = SolrInterface("http://test.example.com/", http_connection=http,
+                           schema_cache_dir=cache_dir, schema_cache_ttl=60)
+        assert_equal(http.schema_requests, [None])
+        # A second worker starting up within the ttl doesn't ask Solr.
+        si2 = SolrInterface("http://test.example.com/", http_connection=http,
+                            schema_cache_dir=cache_dir, schema_cache_ttl=60)
+        assert_equal(len(http.schema_requests), 1)
+        assert_equal(sorted(si2.schema.fields), sorted(si.schema.fields))
+        assert_equal(si2.schema.unique_key, "int_field")
+        assert si2.schema.fields["string_field"].multi_valued
+        # Re-reading the schema asks Solr, conditionally.
+        si2.init_schema()
+        assert_equal(http.schema_requests[-1], '"v1"')
+        assert_equal(sorted(si2.schema.fields), sorted(si.schema.fields))
+        # And without a ttl, Solr is always asked.
+        SolrInterface("http://test.example.com/", http_connection=http,
+                      schema_cache_dir=cache_dir)
+        assert_equal(len(http.schema_requests), 3)
+    finally:
+        shutil.rmtree(cache_dir)
+
+class GzipMockConnection(UpdateMockConnection):
+    def _handle_request(self, u, params, method, body, headers):
+        if isinstance(body, ChunkedBody):
+            body = read_chunked_body(body)
+        if headers.get('Content-Encoding') == 'gzip':
+            body = gunzip_string(body)
+        if method == 'POST' and u.path.endswith('/select/'):
+            self.tracking_dict['form'] = cgi.parse_qs(body)
+            return PaginationMockConnection._handle_request.im_func(
+                self, u, self.tracking_dict['form'], 'GET', body, headers)
+        return super(GzipMockConnection, self)._handle_request(u, params, method, body, headers)
+
+def test_gzip_update_bodies():
+    http = GzipMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http, gzip_min_size=100)
+    si.add(update_docs[:10])
+    assert_equal(http.tracking_dict['headers']['Content-Encoding'], 'gzip')
+    assert_equal(http.updates[-1][1], str(si.schema.make_update(update_docs[:10])))
+    si.add(update_docs[:10], stream=True)
+    assert_equal(http.tracking_dict['headers']['Content-Encoding'], 'gzip')
+    assert_equal(http.updates[-1][1], str(si.schema.make_update(update_docs[:10])))
+    # Small bodies aren't worth compressing.
+    si.commit()
+    assert 'Content-Encoding' not in http.tracking_dict['headers']
+    assert_equal(http.updates[-1][1], '<commit/>')
+
+def test_gzip_long_select():
+    http = GzipMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http,
+                       gzip_min_size=100, max_length_get_url=100)
+    response = si.query(si.Q(text_field="x" * 200) | si.Q("*")).paginate(start=3, rows=2).execute()
+    assert_equal(http.tracking_dict['method'], 'POST')
+    assert_equal(http.tracking_dict['headers']['Content-Encoding'], 'gzip')
+    assert_equal(http.tracking_dict['form']['start'], ['3'])
+    assert_equal([d['int_field'] for d in response], [3, 4])
+
+def test_gzip_responses():
+    class GzippedResponseConnection(PaginationMockConnection):
+        class MockStatus(dict):
+            def __init__(self, status):
+                super(GzippedResponseConnection.MockStatus, self).__init__({'content-encoding': 'gzip'})
+                self.status = status
+        def _handle_request(self, *args):
+            status, body = PaginationMockConnection._handle_request(self, *args)
+            return status, gzip_string(body)
+    http = GzippedResponseConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http,
+                       schemadoc=StringIO(schema_string))
+    assert_equal([d['int_field'] for d in si.query("*").paginate(rows=3).execute()], [0, 1, 2])
+    assert_equal(http.tracking_dict['headers']['Accept-Encoding'], 'gzip')
+
+class FlakyMockConnection(UpdateMockConnection, PaginationMockConnection):
+    """Fails the first `failures` requests, with a socket error, or
+    the given status or exception."""
+    def __init__(self, failures, status=None):
+        super(FlakyMockConnection, self).__init__()
+        self.failures = failures
+        self.status = status
+        self.attempts = 0
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        self.attempts += 1
+        if self.attempts <= self.failures:
+            if self.status is None:
+                raise socket.error("connection refused")
+            if isinstance(self.status, Exception):
+                raise self.status
+            return self.MockStatus(self.status), "unavailable"
+        return super(FlakyMockConnection, self).request(uri, method, body, headers)
+
+    def _handle_request(self, u, params, method, body, headers):
+        return UpdateMockConnection._handle_request(self, u, params, method, body, headers) \
+            or PaginationMockConnection._handle_request.im_func(self, u, params, method, body, headers)
+
+def flaky_interface(failures, status=None, **kwargs):
+    http = FlakyMockConnection(0)
+    si = SolrInterface("http://test.example.com/", http_connection=http,
+                       schemadoc=StringIO(schema_string), **kwargs)
+    http.failures, http.status = failures, status
+    return http, si
+
+def test_retry_policy_reads():
+    for status in (None, 503):
+        http, si = flaky_interface(2, status, retry_policy=RetryPolicy(backoff=0))
+        assert_equal(len(si.query("*").paginate(rows=1).execute()), 10)
+        assert_equal(http.attempts, 3)
+    http, si = flaky_interface(5, 503, retry_policy=RetryPolicy(max_retries=3, backoff=0))
+    try:
+        si.query("*").execute()
+    except SolrError:
+        pass
+    else:
+        assert False
+    assert_equal(http.attempts, 4)
+
+def test_retry_policy_updates():
+    http, si = flaky_interface(1, 503, retry_policy=RetryPolicy(backoff=0))
+    try:
+        si.add(update_docs[:1])
+    except SolrError:
+        pass
+    else:
+        assert False
+    assert_equal(http.attempts, 1)
+    http, si = flaky_interface(1, 503, retry_policy=RetryPolicy(backoff=0, retry_updates=True))
+    si.add(update_docs[:1])
+    assert_equal(http.attempts, 2)
+
+def test_retry_timeout_compatibility():
+    http, si = flaky_interface(1, retry_timeout=0)
+    si.add(update_docs[:1])
+    assert_equal(http.attempts, 2)
+    http, si = flaky_interface(2, retry_timeout=0)
+    try:
+        si.add(update_docs[:1])
+    except socket.error:
+        pass
+    else:
+        assert False
+    # Statuses weren't retried
+    http, si = flaky_interface(1, 503, retry_timeout=0)
+    try:
+        si.query("*").execute()
+    except SolrError:
+        pass
+    else:
+        assert False
+
+def test_retry_backoff():
+    policy = RetryPolicy(backoff=0.1, max_backoff=1.0, jitter=False)
+    assert_equal([policy.delay(i) for i in range(6)], [0.1, 0.2, 0.4, 0.8, 1.0, 1.0])
+    policy = RetryPolicy(backoff=0.1, max_backoff=1.0)
+    assert all(0 <= policy.delay(3) <= 0.8 for i in range(20))
+
+def test_circuit_breaker():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=60)
+    http, si = flaky_interface(3, 503, circuit_breaker=breaker)
+    for i in range(2):
+        try:
+            si.query("*").execute()
+        except SolrError, e:
+            assert not isinstance(e, CircuitOpenError)
+    try:
+        si.query("*").execute()
+    except CircuitOpenError:
+        pass
+    else:
+        assert False
+    assert_equal(http.attempts, 2)
+    # After the reset timeout, one trial request is allowed through.
+    breaker.reset_timeout = 0
+    try:
+        si.query("*").execute()
+    except CircuitOpenError:
+        assert False
+    except SolrError:
+        pass
+    assert_equal(breaker.state, CircuitBreaker.open)
+    assert_equal(len(si.query("*").paginate(rows=1).execute()), 10)
+    assert_equal(breaker.state, CircuitBreaker.closed)
+
+def test_circuit_breaker_other_errors():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    http, si = flaky_interface(2, httplib.BadStatusLine(""), circuit_breaker=breaker)
+    for i in range(2):
+        try:
+            si.query("*").execute()
+        except CircuitOpenError:
+            assert i == 1
+        except httplib.BadStatusLine:
+            assert i == 0
+    assert_equal(breaker.state, CircuitBreaker.open)
+    # A failed trial request opens the breaker again...
+    breaker.reset_timeout = 0
+    try:
+        si.query("*").execute()
+    except httplib.BadStatusLine:
+        pass
+    else:
+        assert False
+    assert_equal(breaker.state, CircuitBreaker.open)
+    assert_equal(len(si.query("*").paginate(rows=1).execute()), 10)
+    assert_equal(breaker.state, CircuitBreaker.closed)
+
+def test_circuit_breaker_lost_trial():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    breaker.reset_timeout = 0
+    assert breaker.allow()
+    assert_equal(breaker.state, CircuitBreaker.half_open)
+    # The trial's outcome never arrives; another is let through in time.
+    breaker.reset_timeout = 60
+    assert not breaker.allow()
+    breaker.reset_timeout = 0
+    assert breaker.allow()
+
+class ReplicaMockConnection(UpdateMockConnection):
+    def __init__(self):
+        super(ReplicaMockConnection, self).__init__()
+        self.hits = {}
+        self.down = set()
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        host = urlparse.urlparse(uri).netloc
+        self.hits[host] = self.hits.get(host, 0) + 1
+        if host in self.down:
+            raise socket.error("connection refused")
+        return super(ReplicaMockConnection, self).request(uri, method, body, headers)
+
+    def _handle_request(self, u, params, method, body, headers):
+        if u.path.endswith('/admin/ping'):
+            return self.MockStatus(200), "OK"
+        return UpdateMockConnection._handle_request(self, u, params, method, body, headers) \
+            or PaginationMockConnection._handle_request.im_func(self, u, params, method, body, headers)
+
+replica_urls = ["http://a.example.com/solr/", "http://b.example.com/solr/", "http://c.example.com/solr/"]
+
+def test_load_balancing():
+    for policy in LoadBalancedConnection.policies:
+        http = ReplicaMockConnection()
+        si = SolrInterface(replica_urls, http_connection=http, load_balancing=policy)
+        assert_equal(http.hits, {"a.example.com": 1}) # the schema
+        for i in range(60):
+            si.query("*").execute()
+        assert_equal(sorted(http.hits), ["a.example.com", "b.example.com", "c.example.com"])
+        hits = dict(http.hits)
+        si.add(update_docs[:1])
+        si.commit()
+        http.hits["a.example.com"] -= 2
+        assert_equal(http.hits, hits)
+
+def test_load_balancing_failover():
+    http = ReplicaMockConnection()
+    si = SolrInterface(replica_urls, http_connection=http)
+    http.down.add("b.example.com")
+    for i in range(30):
+        assert_equal(len(si.query("*").execute()), 10)
+    # b was tried once, then taken out of rotation.
+    assert_equal(http.hits["b.example.com"], 1)
+    # If every replica is failing, the last error is raised.
+    http.down.update(["a.example.com", "c.example.com"])
+    try:
+        si.query("*").execute()
+    except socket.error:
+        pass
+    else:
+        assert False
+
+def test_load_balancing_health_checks():
+    http = ReplicaMockConnection()
+    si = SolrInterface(replica_urls, http_connection=http)
+    http.down.add("c.example.com")
+    si.conn.check_health()
+    assert_equal([r.available for r in si.conn.replicas], [True, True, False])
+    http.hits.clear()
+    for i in range(20):
+        si.query("*").execute()
+    assert "c.example.com" not in http.hits
+    http.down.clear()
+    si.conn.check_health()
+    assert all(r.available for r in si.conn.replicas)
+
+def test_health_checks_need_pool():
+    try:
+        SolrInterface(replica_urls, http_connection=ReplicaMockConnection(),
+                      schemadoc=StringIO(schema_string), health_check_interval=60)
+    except ValueError:
+        pass
+    else:
+        assert False
+    si = SolrInterface(replica_urls, schemadoc=StringIO(schema_string), health_check_interval=60)
+    try:
+        for replica in si.conn.replicas:
+            assert isinstance(replica.conn.http_connection, ConnectionPool)
+    finally:
+        si.conn.close()
+
+def test_latency_weighting():
+    replicas = [ReplicaState(None) for i in range(2)]
+    replicas[0].latency, replicas[1].latency = 0.01, 0.09
+    chosen = [LoadBalancedConnection.weighted_choice(replicas) for i in range(1000)]
+    assert chosen.count(replicas[0]) > 800
+
+def test_background_health_checks():
+    http = ReplicaMockConnection()
+    si = SolrInterface(replica_urls, http_connection=shared_pool(http, 2), health_check_interval=0.001)
+    try:
+        http.down.add("c.example.com")
+        deadline = time.time() + 5
+        while si.conn.replicas[2].available and time.time() < deadline:
+            time.sleep(0.001)
+        assert not si.conn.replicas[2].available
+    finally:
+        si.conn.close()
+    assert not si.conn.health_thread.is_alive()
+
+
+class ShardMockConnection(ReplicaMockConnection):
+    def __init__(self):
+        super(ShardMockConnection, self).__init__()
+        self.shard_updates = {}
+        self.select_params = []
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        u = urlparse.urlparse(uri)
+        if method == 'POST' and u.path.endswith('/update/'):
+            self.shard_updates.setdefault(u.netloc, []).append(body)
+        elif u.path.endswith('/select/'):
+            self.select_params.append((u.netloc, cgi.parse_qs(u.query)))
+        return super(ShardMockConnection, self).request(uri, method, body, headers)
+
+def test_sharded_add():
+    http = ShardMockConnection()
+    si = ShardedSolrInterface(replica_urls, http_connection=http)
+    # The schema is only fetched from the first shard.
+    assert_equal(http.hits, {"a.example.com": 1})
+    si.add(update_docs)
+    docs = {}
+    for host, bodies in http.shard_updates.items():
+        assert_equal(len(bodies), 1)
+        docs[host] = bodies[0].count('<doc>')
+    assert_equal(sorted(docs), ["a.example.com", "b.example.com", "c.example.com"])
+    assert_equal(sum(docs.values()), 25)
+    # Each document went to the shard which owns it.
+    for doc in update_docs:
+        host = urlparse.urlparse(si.shard_for(doc).conn.url).netloc
+        assert '<field name="int_field">%s</field>' % doc["int_field"] in http.shard_updates[host][0]
+
+def test_sharded_add_chunks():
+    http = ShardMockConnection()
+    si = ShardedSolrInterface(replica_urls, http_connection=http)
+    si.add(iter(update_docs), chunk=10, commit=True)
+    bodies = sum(http.shard_updates.values(), [])
+    assert_equal(sum(b.count('<doc>') for b in bodies), 25)
+    # No update carried more than one chunk's documents.
+    assert max(b.count('<doc>') for b in bodies) <= 10
+    # Each shard was committed once, after all the chunks.
+    for host, bodies in http.shard_updates.items():
+        assert_equal(bodies[-1], '<commit/>')
+        assert_equal(bodies.count('<commit/>'), 1)
+
+def test_sharded_cache():
+    http = ShardMockConnection()
+    si = ShardedSolrInterface(replica_urls, http_connection=http, cache_size=1024*1024)
+    caches = set(id(shard.cache) for shard in si.shards)
+    assert_equal(len(caches), 1)
+    si.query("*").execute()
+    si.query("*").execute()
+    assert_equal(len(http.select_params), 1)
+    # Deleting from any shard invalidates the distributed query's results.
+    si.delete(docs=[d["int_field"] for d in update_docs
+                    if si.shard_for(d) is not si.shards[0]][:1])
+    si.query("*").execute()
+    assert_equal(len(http.select_params), 2)
+
+def test_sharded_delete():
+    http = ShardMockConnection()
+    si = ShardedSolrInterface(replica_urls, http_connection=http)
+    si.delete(docs=[3, 4])
+    owners = set(urlparse.urlparse(si.shard_for(i).conn.url).netloc for i in [3, 4])
+    assert_equal(set(http.shard_updates), owners)
+    # The same document is owned by the same shard, however it's given.
+    assert si.shard_for(3) is si.shard_for({"int_field": 3})
+    assert si.shard_for(3) is si.shard_for("3")
+    http.shard_updates.clear()
+    si.delete(queries=si.Q(string_field="s1"))
+    si.commit()
+    assert_equal(sorted(http.shard_updates), ["a.example.com", "b.example.com", "c.example.com"])
+    for bodies in http.shard_updates.values():
+        assert_equal(len(bodies), 2)
+
+def test_sharded_delete_docs_and_queries():
+    http = ShardMockConnection()
+    si = ShardedSolrInterface(replica_urls, http_connection=http)
+    si.delete(docs=[3, 4], queries=si.Q(string_field="s1"))
+    owners = set(urlparse.urlparse(si.shard_for(i).conn.url).netloc for i in [3, 4])
+    assert_equal(sorted(http.shard_updates), ["a.example.com", "b.example.com", "c.example.com"])
+    # One request per shard, carrying its own ids as well as the query.
+    for host, bodies in http.shard_updates.items():
+        assert_equal(len(bodies), 1)
+        assert '<query>string_field:s1</query>' in bodies[0]
+        assert ('<id>' in bodies[0]) == (host in owners)
+
+def test_sharded_add_reports_failed_shards():
+    http = ShardMockConnection()
+    si = ShardedSolrInterface(replica_urls, http_connection=http)
+    http.down.add("b.example.com")
+    try:
+        si.add(update_docs)
+    except SolrUpdateError, e:
+        assert_equal([i for i, _ in e.errors], [1])
+    else:
+        assert False
+
+def test_sharded_search():
+    http = ShardMockConnection()
+    si = ShardedSolrInterface(replica_urls, http_connection=http)
+    si.query("*").execute()
+    assert_equal([host for host, params in http.select_params], ["a.example.com"])
+    assert_equal(http.select_params[0][1]["shards"],
+                 ["a.example.com/solr,b.example.com/solr,c.example.com/solr"])
+
+class SlowReplicaMockConnection(ReplicaMockConnection):
+    def __init__(self):
+        super(SlowReplicaMockConnection, self).__init__()
+        self.slow = {}
+
+    def request(self, uri, method='GET', body=None, headers=None):
+        time.sleep(self.slow.get(urlparse.urlparse(uri).netloc, 0))
+        return super(SlowReplicaMockConnection, self).request(uri, method, body, headers)
+
+def hedging_pool(http):
+    return shared_pool(http, LoadBalancedConnection.hedge_burst + 1)
+
+def test_hedging_needs_pool():
+    try:
+        SolrInterface(replica_urls[:2], http_connection=SlowReplicaMockConnection(),
+                      schemadoc=StringIO(schema_string), hedge_percentile=90)
+    except ValueError:
+        pass
+    else:
+        assert False
+    si = SolrInterface(replica_urls[:2], schemadoc=StringIO(schema_string), hedge_percentile=90)
+    for replica in si.conn.replicas:
+        assert_equal(replica.conn.http_connection.size, LoadBalancedConnection.hedge_burst + 1)
+
+def test_hedged_queries():
+    http = SlowReplicaMockConnection()
+    si = SolrInterface(replica_urls[:2], http_connection=hedging_pool(http), load_balancing='latency',
+                       hedge_percentile=90, hedge_budget=1.0)
+    si.conn.latencies.extend([0.001] * 20)
+    # Make sure the query goes to a first.
+    si.conn.replicas[0].latency = 0.001
+    si.conn.replicas[1].latency = 1000
+    http.slow["a.example.com"] = 0.5
+    t0 = time.time()
+    assert_equal(len(si.query("*").execute()), 10)
+    # It was hedged to b, and answered from there.
+    assert time.time() - t0 < 0.4
+    assert_equal(si.conn.hedges, 1)
+    assert_equal(http.hits.get("b.example.com"), 1)
+
+def test_hedge_budget():
+    http = SlowReplicaMockConnection()
+    si = SolrInterface(replica_urls[:2], http_connection=hedging_pool(http),
+                       hedge_percentile=90, hedge_budget=0.0)
+    si.conn.latencies.extend([0.001] * 20)
+    http.slow["a.example.com"] = 0.05
+    for i in range(4):
+        assert_equal(len(si.query("*").execute()), 10)
+    assert_equal(si.conn.hedges, 0)
+    assert_equal(sum(http.hits.values()), 1 + 4)
+    # With no budget to hedge, the queries ran in this thread.
+    assert_equal(si.conn.attempt_threads.idle, 0)
+
+def test_hedging_reuses_threads():
+    http = SlowReplicaMockConnection()
+    si = SolrInterface(replica_urls[:2], http_connection=hedging_pool(http),
+                       hedge_percentile=90, hedge_budget=1.0)
+    si.conn.latencies.extend([1.0] * 20)
+    for i in range(10):
+        assert_equal(len(si.query("*").execute()), 10)
+    assert_equal(si.conn.hedges, 0)
+    time.sleep(0.05)
+    # Not a thread per query.
+    assert 1 <= si.conn.attempt_threads.idle <= 3
+
+def test_hedging_needs_samples():
+    http = SlowReplicaMockConnection()
+    si = SolrInterface(replica_urls[:2], http_connection=hedging_pool(http), hedge_percentile=90)
+    assert_equal(si.conn.hedge_delay(), None)
+    for i in range(LoadBalancedConnection.hedge_min_samples):
+        si.query("*").execute()
+    assert si.conn.hedge_delay() is not None
+
+class DeadlineMockConnection(PaginationMockConnection):
+    """Records its socket timeout, and flags responses to queries with
+    a timeAllowed as partial."""
+    def __init__(self):
+        super(DeadlineMockConnection, self).__init__()
+        self.timeout = None
+        self.timeouts = []
+
+    def _handle_request(self, u, params, method, body, headers):
+        self.timeouts.append(self.timeout)
+        status, c = super(DeadlineMockConnection, self)._handle_request(u, params, method, body, headers)
+        if "timeAllowed" in params:
+            c = c.replace('<int name="QTime">0</int>',
+                          '<int name="QTime">0</int><bool name="partialResults">true</bool>')
+        return status, c
+
+def test_deadline():
+    http = DeadlineMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    response = si.query("*").execute()
+    assert not response.partial_results
+    assert "timeAllowed" not in http.tracking_dict["params"]
+    assert_equal(http.timeouts[-1], None)
+    response = si.query("*").execute(deadline=time.time() + 10)
+    assert response.partial_results
+    time_allowed = int(http.tracking_dict["params"]["timeAllowed"][0])
+    assert 9000 < time_allowed <= 10000
+    assert 9 < http.timeouts[-1] <= 10
+    # The socket timeout is put back afterwards.
+    assert_equal(http.timeout, None)
+
+def test_deadline_passed():
+    http = DeadlineMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http)
+    requests = len(http.timeouts)
+    try:
+        si.query("*").execute(deadline=time.time() - 1)
+    except DeadlineExceeded:
+        pass
+    else:
+        assert False
+    assert_equal(len(http.timeouts), requests)
+
+class TimeoutReplicaMockConnection(ReplicaMockConnection):
+    """Times out queries, once the socket timeout has passed."""
+    def __init__(self):
+        super(TimeoutReplicaMockConnection, self).__init__()
+        self.timeout = None
+
+    def _handle_request(self, u, params, method, body, headers):
+        if "q" in params and self.timeout is not None:
+            time.sleep(self.timeout)
+            raise socket.timeout("timed out")
+        return super(TimeoutReplicaMockConnection, self)._handle_request(u, params, method, body, headers)
+
+def test_deadline_is_not_a_failure():
+    http = TimeoutReplicaMockConnection()
+    si = SolrInterface(replica_urls, http_connection=http,
+                       circuit_breaker=CircuitBreaker(failure_threshold=1))
+    hits = sum(http.hits.values())
+    try:
+        si.query("*").execute(deadline=time.time() + 0.02)
+    except DeadlineExceeded:
+        pass
+    else:
+        assert False
+    # No other replica was tried, and none was taken out of rotation.
+    assert_equal(sum(http.hits.values()), hits + 1)
+    for replica in si.conn.replicas:
+        assert replica.available
+        assert_equal(replica.conn.circuit_breaker.state, CircuitBreaker.closed)
+
+def test_deadline_limits_retries():
+    http, si = flaky_interface(1, retry_policy=RetryPolicy(backoff=1.0, jitter=False))
+    t0 = time.time()
+    try:
+        si.query("*").execute(deadline=time.time() + 0.5)
+    except socket.error:
+        pass
+    else:
+        assert False
+    assert_equal(http.attempts, 1)
+    assert time.time() - t0 < 0.5
+
+
+def test_instrumentation_failed_queries():
+    events = []
+    http, si = flaky_interface(2, 503, instrumentation=Instrumentation([events.append]),
+                               circuit_breaker=CircuitBreaker(failure_threshold=1))
+    for error in (SolrError, CircuitOpenError):
+        try:
+            si.query("*").execute()
+        except error:
+            pass
+        else:
+            assert False
+    try:
+        si.query("*").execute(deadline=time.time() - 1)
+    except DeadlineExceeded:
+        pass
+    else:
+        assert False
+    traces = [e.trace for e in events if e.phase == 'complete']
+    assert_equal(len(traces), 3)
+    assert_equal([type(t.error) for t in traces], [SolrError, CircuitOpenError, DeadlineExceeded])
+    assert all(t.duration is not None for t in traces)
+
+def test_instrumentation():
+    events = []
+    http = PaginationMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http,
+                       instrumentation=Instrumentation([events.append]))
+    si.query("*").paginate(rows=3).execute()
+    assert_equal([e.phase for e in events],
+                 ['build_params', 'build_params', 'encode_url', 'http', 'parse',
+                  'transform', 'complete'])
+    trace = events[-1].trace
+    assert all(e.trace is trace for e in events)
+    assert_equal(trace.kind, 'select')
+    assert_equal(trace.method, 'GET')
+    assert_equal(trace.url, http.tracking_dict['url'])
+    assert_equal(trace.request_bytes, len(trace.url))
+    assert trace.response_bytes > 0
+    assert_equal(trace.status, 200)
+    assert_equal(trace.qtime, 0)
+    assert not trace.posted and not trace.cached
+    assert_equal(trace.overhead, trace.timings['http'])
+    assert trace.duration >= sum(trace.timings.values())
+    # search() on its own is traced too.
+    del events[:]
+    si.search(q="*")
+    assert_equal([e.phase for e in events],
+                 ['build_params', 'encode_url', 'http', 'parse', 'complete'])
+
+def test_instrumentation_post_fallback():
+    events = []
+    http = GzipMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=http, max_length_get_url=100,
+                       instrumentation=Instrumentation([events.append]))
+    si.query(si.Q(text_field="x" * 200)).execute()
+    trace = events[-1].trace
+    assert trace.posted
+    assert_equal(trace.method, 'POST')
+    assert trace.request_bytes > 200
+
+def test_instrumentation_cache_hits():
+    events = []
+    si = SolrInterface("http://test.example.com/", http_connection=PaginationMockConnection(),
+                       cache_size=10000, instrumentation=Instrumentation([events.append]))
+    si.query("*").execute()
+    del events[:]
+    si.query("*").execute()
+    assert events[-1].trace.cached
+    assert 'http' not in [e.phase for e in events]
+
+def test_instrumentation_listener_errors():
+    def broken(event):
+        raise ValueError
+    si = SolrInterface("http://test.example.com/", http_connection=PaginationMockConnection(),
+                       instrumentation=Instrumentation([broken]))
+    assert_equal(len(si.query("*").execute()), 10)
+
+class MultiSearchMockConnection(PaginationMockConnection):
+    """Takes delay seconds to answer each query, failing those for
+    "broken"."""
+    delay = 0.2
+
+    def _handle_request(self, u, params, method, body, headers):
+        time.sleep(self.delay)
+        if params.get("q") == ["broken"]:
+            return self.MockStatus(500), "broken"
+        return super(MultiSearchMockConnection, self)._handle_request(u, params, method, body, headers)
+
+def test_execute_many():
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string),
+                       http_connection=ConnectionPool(5, factory=MultiSearchMockConnection))
+    searches = [si.query("*").paginate(start=i, rows=1) for i in range(4)]
+    searches.insert(2, si.query("broken"))
+    t0 = time.time()
+    responses = si.execute_many(searches, max_concurrency=5)
+    # They ran at the same time, rather than one after another.
+    assert time.time() - t0 < 2 * MultiSearchMockConnection.delay
+    assert_equal(len(responses), 5)
+    assert isinstance(responses[2], SolrError)
+    del responses[2]
+    assert_equal([[d['int_field'] for d in r] for r in responses], [[0], [1], [2], [3]])
+    assert_equal(si.execute_many([]), [])
+
+def test_execute_many_concurrency():
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string),
+                       http_connection=ConnectionPool(5, factory=MultiSearchMockConnection))
+    t0 = time.time()
+    responses = si.execute_many([si.query("*")] * 4, max_concurrency=2)
+    assert time.time() - t0 >= 2 * MultiSearchMockConnection.delay
+    assert_equal([len(r) for r in responses], [10] * 4)
+
+def test_execute_many_needs_pool():
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string),
+                       http_connection=MultiSearchMockConnection())
+    try:
+        si.execute_many([si.query("*")] * 2)
+    except ValueError:
+        pass
+    else:
+        assert False
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string), pool_size=2)
+    try:
+        si.execute_many([si.query("*")] * 4)
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_ensure_pool():
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string))
+    assert not isinstance(si.conn.http_connection, ConnectionPool)
+    si.conn.ensure_pool(4)
+    pool = si.conn.http_connection
+    assert_equal(pool.size, 4)
+    si.conn.ensure_pool(2)
+    assert si.conn.http_connection is pool
+    si.conn.ensure_pool(8)
+    assert_equal(si.conn.http_connection.size, 8)
+
+def test_submit():
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string),
+                       http_connection=ConnectionPool(5, factory=MultiSearchMockConnection),
+                       max_workers=5)
+    t0 = time.time()
+    first = si.query("*").paginate(rows=2).submit()
+    second = si.query("broken").submit()
+    # Neither has waited for Solr.
+    assert time.time() - t0 < MultiSearchMockConnection.delay
+    assert_equal([d['int_field'] for d in first.result()], [0, 1])
+    assert isinstance(second.exception(), SolrError)
+    si.shutdown()
+
+def test_submit_updates():
+    http = UpdateMockConnection()
+    si = SolrInterface("http://test.example.com/", http_connection=shared_pool(http, 1), max_workers=1)
+    si.submit_add(update_docs[:2]).result()
+    si.submit_delete(queries=si.Q(string_field="s1")).result()
+    assert_equal([b.count('<doc>') for p, b in http.updates], [2, 0])
+    assert '<query>string_field:s1</query>' in http.updates[-1][1]
+    si.shutdown()
+    assert_equal(si._executor, None)
+
+def test_submit_needs_pool():
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string),
+                       http_connection=MultiSearchMockConnection())
+    try:
+        si.query("*").submit()
+    except ValueError:
+        pass
+    else:
+        assert False
+    try:
+        AsyncSolrInterface(interface=si, max_workers=2)
+    except ValueError:
+        pass
+    else:
+        assert False
+    # The default connection is replaced by a pool of max_workers.
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string), max_workers=3)
+    si.executor
+    assert_equal(si.conn.http_connection.size, 3)
+    si.shutdown()
+
+def test_single_flight():
+    flight = SingleFlight()
+    started = threading.Event()
+    calls = []
+    def slow():
+        calls.append(1)
+        started.set()
+        time.sleep(0.2)
+        return "body"
+    results = []
+    leader = threading.Thread(target=lambda: results.append(flight.fetch("k", slow)))
+    leader.start()
+    started.wait()
+    followers = [threading.Thread(target=lambda: results.append(flight.fetch("k", slow)))
+                 for i in range(3)]
+    for t in followers:
+        t.start()
+    for t in [leader] + followers:
+        t.join()
+    assert_equal(len(calls), 1)
+    assert_equal(sorted(results), [("body", False)] + [("body", True)] * 3)
+    assert_equal((flight.calls, flight.coalesced), (1, 3))
+    # Once it's finished, the next call is made afresh.
+    assert_equal(flight.fetch("k", lambda: "new"), ("new", False))
+
+def test_coalesced_queries():
+    requests = []
+    class CountingConnection(MultiSearchMockConnection):
+        def request(self, *args, **kwargs):
+            requests.append(args)
+            return MultiSearchMockConnection.request(self, *args, **kwargs)
+    events = []
+    si = SolrInterface("http://test.example.com/", schemadoc=StringIO(schema_string),
+                       http_connection=ConnectionPool(10, factory=CountingConnection),
+                       coalesce=True, instrumentation=Instrumentation([events.append]))
+    responses = si.execute_many([si.query("*")] * 5 + [si.query("broken")] * 3,
+                                max_concurrency=8)
+    assert_equal(len(requests), 2)
+    assert_equal([len(r) for r in responses[:5]], [10] * 5)
+    # Each caller gets its own response, parsed from the shared body.
+    assert len(set(id(r) for r in responses[:5])) == 5
+    assert all(isinstance(r, SolrError) for r in responses[5:])
+    traces = [e.trace for e in events if e.phase == 'complete']
+    assert_equal(sorted(t.coalesced for t in traces if t.error is None), [False] + [True] * 4)
+    # The failed queries are traced too.
+    assert_equal(len([t for t in traces if isinstance(t.error, SolrError)]), 3)
+
+def test_prefetch():
+    starts = []
+    class RecordingConnection(PaginationMockConnection):
+        def _handle_request(self, u, params, method, body, headers):
+            starts.append((int(params["start"][0]), int(params["rows"][0])))
+            return PaginationMockConnection._handle_request(self, u, params, method, body, headers)
+    si = SolrInterface("http://test.example.com/", http_connection=shared_pool(RecordingConnection(), 2))
+    assert_equal([d['int_field'] for d in si.query("*").prefetch(page_size=3, read_ahead=2)],
+                 range(10))
+    assert_equal(starts, [(0, 3), (3, 3), (6, 3), (9, 3)])
+    # paginate() bounds the results.
+    del starts[:]
+    assert_equal([d['int_field'] for d in si.query("*").paginate(start=2, rows=5).prefetch(page_size=3)],
+                 [2, 3, 4, 5, 6])
+    assert_equal(starts, [(2, 3), (5, 2)])
+    # Iterating over a search prefetches too.
+    del starts[:]
+    assert_equal([d['int_field'] for d in si.query("*").paginate(rows=4)], [0, 1, 2, 3])
+    assert_equal(starts, [(0, 4)])
+
+def test_prefetch_needs_pool():
+    si = SolrInterface("http://test.example.com/", http_connection=PaginationMockConnection())
+    try:
+        list(si.query("*"))
+    except ValueError:
+        pass
+    else:
+        assert False
+
+def test_prefetch_errors():
+    class FailingPageConnection(PaginationMockConnection):
+        def _handle_request(self, u, params, method, body, headers):
+            if params.get("start") == ["8"]:
+                return self.MockStatus(500), "failed"
+            return PaginationMockConnection._handle_request(self, u, params, method, body, headers)
+    si = SolrInterface("http://test.example.com/", http_connection=shared_pool(FailingPageConnection(), 2))
+    results = []
+    try:
+        for doc in si.query("*").prefetch(page_size=4):
+            results.append(doc['int_field'])
+    except SolrError:
+        pass
+    else:
+        assert False
+    # The pages before the failure were still returned.
+    assert_equal(results, range(8))
+
+def test_prefetch_stops_early():
+    si = SolrInterface("http://test.example.com/", http_connection=shared_pool(PaginationMockConnection(), 2))
+    threads = threading.active_count()
+    results = si.query("*").prefetch(page_size=1, read_ahead=1)
+    results.next()
+    results.close()
+    deadline = time.time() + 5
+    while threading.active_count() > threads and time.time() < deadline:
+        time.sleep(0.01)
+    assert_equal(threading.active_count(), threads)
@@ -0,0 +1,385 @@
+from __future__ import absolute_import
+
+import contextlib
+import functools
+import random
+import threading
+import time
+import zlib
+
+from .schema import SolrError
+
+
+class PoolStats(object):
+    """Counters describing how long callers waited to check a
+    connection out of a ConnectionPool."""
+    def __init__(self):
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def mean_wait(self):
+        if not self.checkouts:
+            return 0.0
+        return self.total_wait / self.checkouts
+
+    def __repr__(self):
+        return "<PoolStats checkouts=%s timeouts=%s mean_wait=%.6f max_wait=%.6f>" \
+            % (self.checkouts, self.timeouts, self.mean_wait, self.max_wait)
+
+
+class ConnectionPool(object):
+    """A thread-safe pool of httplib2.Http objects.
+
+    Each Http object keeps its own persistent keep-alive connection
+    per host, so a pool of size n allows up to n concurrent requests
+    to each Solr host without paying for TCP setup on every request.
+    The pool exposes the same request() method as httplib2.Http, so it
+    can be used anywhere an http_connection is accepted.
+    """
+    def __init__(self, size=10, timeout=None, factory=None):
+        if size < 1:
+            raise ValueError("pool size must be 1 or greater")
+        if factory is None:
+            import httplib2
+            factory = httplib2.Http
+        self.size = size
+        self.timeout = timeout
+        self.factory = factory
+        # LIFO, so that the most recently used (and so most likely
+        # still open) connection is handed out first.
+        self.idle = []
+        self.created = 0
+        self.lock = threading.Lock()
+        # Signalled whenever a connection is checked in or discarded,
+        # so that waiting threads can take it, or create a new one.
+        self.available = threading.Condition(self.lock)
+        self.stats = PoolStats()
+
+    def checkout(self):
+        t0 = time.time()
+        with self.available:
+            while True:
+                if self.idle:
+                    http = self.idle.pop()
+                    break
+                if self.created < self.size:
+                    self.created += 1
+                    http = None
+                    break
+                if self.timeout is None:
+                    self.available.wait()
+                    continue
+                remaining = t0 + self.timeout - time.time()
+                if remaining <= 0:
+                    self.stats.timeouts += 1
+                    raise SolrError("Timed out waiting for a connection from the pool")
+                self.available.wait(remaining)
+        if http is None:
+            try:
+                http = self.factory()
+            except:
+                self.release()
+                raise
+        wait = time.time() - t0
+        with self.lock:
+            self.stats.checkouts += 1
+            self.stats.total_wait += wait
+            self.stats.max_wait = max(self.stats.max_wait, wait)
+        return http
+
+    def checkin(self, http):
+        with self.available:
+            self.idle.append(http)
+            self.available.notify()
+
+    def discard(self, http):
+        for conn in getattr(http, "connections", {}).values():
+            try:
+                conn.close()
+            except Exception:
+                pass
+        self.release()
+
+    def release(self):
+        """Give up the capacity held by a connection which is gone."""
+        with self.available:
+            self.created -= 1
+            self.available.notify()
+
+    def request(self, *args, **kwargs):
+        """As httplib2.Http.request, but with an optional timeout (in
+        seconds) for this request's socket operations."""
+        timeout = kwargs.pop('timeout', None)
+        http = self.checkout()
+        try:
+            request = http.request
+            if isinstance(kwargs.get('body'), ChunkedBody):
+                request = functools.partial(send_once, http)
+            if timeout is None:
+                response = request(*args, **kwargs)
+            else:
+                with socket_timeout(http, timeout):
+                    response = request(*args, **kwargs)
+        except:
+            # The connection may be left in an unknown state; don't
+            # hand it out again.
+            self.discard(http)
+            raise
+        self.checkin(http)
+        return response
+
+
+@contextlib.contextmanager
+def socket_timeout(http, timeout):
+    """Set the socket timeout of an httplib2.Http object for the
+    duration of the block, including on connections it already has
+    open. Objects without a timeout (such as test doubles) are left
+    alone."""
+    if not hasattr(http, "timeout"):
+        yield
+        return
+    def set_timeout(t):
+        http.timeout = t
+        for conn in getattr(http, "connections", {}).values():
+            conn.timeout = t
+            if getattr(conn, "sock", None) is not None:
+                conn.sock.settimeout(t)
+    old_timeout = http.timeout
+    set_timeout(timeout)
+    try:
+        yield
+    finally:
+        set_timeout(old_timeout)
+
+
+class RetryPolicy(object):
+    """Decides which failed requests to retry, and how long to wait
+    before each retry.
+
+    A request is retried if it failed with a socket.error, or got a
+    response with one of retry_statuses, up to max_retries times. The
+    wait before retry n (counting from 0) is backoff * 2**n seconds, up
+    to max_backoff; with jitter, a random time between 0 and that, so
+    that clients which failed together don't all retry together.
+
+    Reads are always safe to retry. Updates are only retried if
+    retry_updates is True: a request which timed out may still have been
+    applied, and a retried add after a commit or a delete-by-query
+    could change the outcome.
+    """
+    def __init__(self, max_retries=3, backoff=0.1, max_backoff=5.0, jitter=True,
+                 retry_statuses=(502, 503, 504), retry_updates=False):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.retry_statuses = frozenset(retry_statuses)
+        self.retry_updates = retry_updates
+
+    @classmethod
+    def from_retry_timeout(cls, retry_timeout):
+        """The policy SolrConnection has always followed for a
+        retry_timeout: retry any request once, retry_timeout seconds
+        after a socket.error."""
+        return cls(max_retries=1, backoff=retry_timeout, max_backoff=retry_timeout,
+                   jitter=False, retry_statuses=(), retry_updates=True)
+
+    def should_retry(self, attempt, idempotent):
+        return attempt < self.max_retries and (idempotent or self.retry_updates)
+
+    def delay(self, attempt):
+        delay = min(self.max_backoff, self.backoff * 2 ** attempt)
+        if self.jitter:
+            delay = random.uniform(0, delay)
+        return delay
+
+
+class CircuitOpenError(SolrError):
+    """Raised, without trying to contact Solr, while a CircuitBreaker
+    is open."""
+
+
+class DeadlineExceeded(SolrError):
+    """Raised when a request's deadline passes before Solr has answered.
+    This says nothing about the health of the server, so it is neither
+    counted by a CircuitBreaker nor makes a replica fail over."""
+
+
+class CircuitBreaker(object):
+    """Stops requests being made to a Solr server which is failing, so
+    that callers fail fast rather than each waiting on it in turn.
+
+    After failure_threshold consecutive failures (any error raised while
+    making the request, or a 5xx response), the breaker opens, and
+    requests raise CircuitOpenError immediately. After reset_timeout
+    seconds, one trial request is let through: if it succeeds the
+    breaker closes again, and if not it stays open for another
+    reset_timeout. If the trial's outcome is never recorded, another
+    trial is let through after a further reset_timeout.
+    """
+    closed, open, half_open = "closed", "open", "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.closed
+        self.failures = 0
+        self.opened_at = None
+        self.lock = threading.Lock()
+
+    def copy(self):
+        """A new, closed, breaker with the same settings."""
+        return self.__class__(self.failure_threshold, self.reset_timeout)
+
+    def allow(self):
+        with self.lock:
+            if self.state == self.closed:
+                return True
+            now = time.time()
+            if now - self.opened_at >= self.reset_timeout:
+                self.state = self.half_open
+                self.opened_at = now
+                return True
+            return False
+
+    def record_success(self):
+        with self.lock:
+            self.state = self.closed
+            self.failures = 0
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.state == self.half_open or self.failures >= self.failure_threshold:
+                self.state = self.open
+                self.opened_at = time.time()
+
+
+class ChunkedBody(object):
+    """A file-like request body which sends the strings produced by an
+    iterable using chunked transfer encoding, so that the whole body
+    never needs to be held in memory.
+
+    Each read() returns the next whole chunk, whatever size is asked
+    for. If the iterable raises an exception, read() records it as
+    error, and raises it too,
+    without ever sending the terminating chunk, so that Solr sees an
+    incomplete request rather than a well-formed partial one; the
+    connection must then be closed (send_once() does so).
+
+    The body can only be sent once: see send_once().
+    """
+    headers = {"Transfer-Encoding": "chunked"}
+
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.finished = False
+        self.sent = False
+        self.error = None
+
+    def read(self, size=-1):
+        if self.finished:
+            return ""
+        while True:
+            try:
+                data = self.iterator.next()
+            except StopIteration:
+                break
+            except Exception, e:
+                self.error = e
+                raise
+            if data:
+                return "%x\r\n%s\r\n" % (len(data), data)
+        self.finished = True
+        return "0\r\n\r\n"
+
+
+class BodyReplayError(SolrError):
+    """A streamed body would have had to be sent a second time."""
+
+
+_one_shot_connection_types = {}
+
+def one_shot_connection_type(scheme):
+    """An httplib2 connection class for scheme which refuses to send a
+    ChunkedBody a second time (as httplib2 would otherwise do, from
+    wherever the first attempt left off, when it retries a request on a
+    connection which dropped), and which closes itself if sending a
+    ChunkedBody fails part way through."""
+    if scheme not in _one_shot_connection_types:
+        import httplib2
+        base = httplib2.SCHEME_TO_CONNECTION[scheme]
+        class OneShotConnection(base):
+            def request(self, method, url, body=None, headers={}):
+                if not isinstance(body, ChunkedBody):
+                    return base.request(self, method, url, body, headers)
+                if body.sent:
+                    self.close()
+                    raise BodyReplayError("Not resending a streamed request body to %s" % self.host)
+                body.sent = True
+                try:
+                    return base.request(self, method, url, body, headers)
+                except:
+                    # Don't leave a partly sent request on the connection.
+                    self.close()
+                    raise
+        _one_shot_connection_types[scheme] = OneShotConnection
+    return _one_shot_connection_types[scheme]
+
+
+def send_once(http, uri, method="GET", body=None, headers=None, **kwargs):
+    """Make a request whose body is a ChunkedBody through http (an
+    httplib2.Http), on a new connection, so that it can't fail because
+    a kept-alive connection has gone stale, and using a connection
+    which never resends the body. Objects other than httplib2.Http
+    (such as test doubles) are simply asked to make the request."""
+    connections = getattr(http, "connections", None)
+    if connections is None:
+        return http.request(uri, method, body=body, headers=headers, **kwargs)
+    import httplib2
+    scheme, authority = httplib2.urlnorm(uri)[:2]
+    stale = connections.pop(scheme + ":" + authority, None)
+    if stale is not None:
+        stale.close()
+    return http.request(uri, method, body=body, headers=headers,
+                        connection_type=one_shot_connection_type(scheme), **kwargs)
+
+
+# zlib's wbits for the gzip format, rather than raw zlib.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+def gzip_string(data, level=6):
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    return compressor.compress(data) + compressor.flush()
+
+def gzip_iter(iterable, level=6):
+    """Compress the strings produced by iterable as a single gzip
+    stream, a piece at a time."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, GZIP_WBITS)
+    for data in iterable:
+        data = compressor.compress(data)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def gunzip_string(data, chunk_size=64*1024):
+    """Decompress gzipped data a chunk at a time, so that the
+    decompressor never needs more than one chunk of input at once."""
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    pieces = []
+    for i in xrange(0, len(data), chunk_size):
+        pieces.append(decompressor.decompress(data[i:i+chunk_size]))
+    pieces.append(decompressor.flush())
+    return "".join(pieces)
+
+def decompress_content(response, content):
+    """httplib2 decompresses gzipped responses itself (and removes the
+    Content-Encoding header when it does), but other http_connection
+    objects may not."""
+    get = getattr(response, "get", None)
+    if get is not None and get("content-encoding") == "gzip":
+        return gunzip_string(content)
+    return content